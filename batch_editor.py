@@ -0,0 +1,226 @@
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import image_editor
+from image_editor import edit_image, normalize_color_pairs, normalize_replacements, resolve_preprocess_options
+
+# 批量编辑支持的图片格式
+IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.gif', '.bmp', '.tif', '.tiff', '.webp'}
+# 结果压缩包中的处理报告文件名
+REPORT_FILENAME = 'report.json'
+
+
+def load_edit_spec(spec):
+    """
+    解析并校验批量编辑规则。
+    :param spec: 字典或 JSON 字符串（JSON 文件只由命令行入口读取，见 main），格式如：
+                 {"replacements": {"原文字": "新文字"},
+                  "colors": [{"source": "#000000", "target": "#FF5733", "tolerance": 10}],
+                  "region": [x, y, w, h], "preprocess": true}
+    :return: 规范化后的规则字典
+    :raises ValueError: 规则不是合法的 JSON 或结构不正确
+    """
+    if isinstance(spec, str):
+        try:
+            spec = json.loads(spec) if spec.strip() else {}
+        except ValueError as e:
+            raise ValueError(f"编辑规则不是合法的 JSON：{e}") from e
+    if not isinstance(spec, dict):
+        raise ValueError("编辑规则必须是 JSON 对象")
+
+    unknown = set(spec) - {'replacements', 'colors', 'region', 'preprocess'}
+    if unknown:
+        raise ValueError(f"未知的编辑规则字段：{', '.join(sorted(unknown))}")
+
+    replacements = spec.get('replacements') or []
+    colors = spec.get('colors') or []
+    region = spec.get('region')
+    preprocess = spec.get('preprocess', False)
+    if not isinstance(replacements, (dict, list)):
+        raise ValueError("replacements 必须是字典或列表")
+    if not isinstance(colors, list):
+        raise ValueError("colors 必须是列表")
+    if region is not None and not (isinstance(region, list) and len(region) == 4 and all(
+            isinstance(value, (int, float)) and not isinstance(value, bool) for value in region)):
+        raise ValueError("region 必须是 [x, y, w, h] 四个数字")
+    if not isinstance(preprocess, (bool, dict)):
+        raise ValueError("preprocess 必须是布尔值或字典")
+
+    # 规则内部的结构错误（如列表项不是二元组、颜色不是字符串）统一转为 ValueError
+    try:
+        replacements = normalize_replacements(replacements)
+        normalize_color_pairs(colors)  # 提前校验颜色规则
+        resolve_preprocess_options(preprocess)
+    except (TypeError, KeyError, IndexError, AttributeError) as e:
+        raise ValueError(f"编辑规则格式不正确：{e!r}") from e
+    if not all(isinstance(replacement, str) for _, replacement in replacements):
+        raise ValueError("替换文字必须是字符串")
+
+    if not replacements and not colors:
+        raise ValueError("编辑规则中没有任何文字或颜色修改")
+    return {
+        'replacements': replacements,
+        'colors': colors,
+        'region': tuple(region) if region else None,
+        'preprocess': preprocess,
+    }
+
+
+def _is_image(name):
+    return os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS
+
+
+def collect_images(source, work_dir):
+    """
+    收集待处理的图片。ZIP 文件会先解压到 work_dir。
+    :param source: ZIP 文件路径或目录路径
+    :param work_dir: 解压用的临时目录
+    :return: (相对路径, 绝对路径) 列表
+    """
+    images = []
+    if os.path.isdir(source):
+        for root, _, files in os.walk(source):
+            for name in sorted(files):
+                if _is_image(name):
+                    path = os.path.join(root, name)
+                    images.append((os.path.relpath(path, source), path))
+        return sorted(images)
+
+    if not zipfile.is_zipfile(source):
+        raise ValueError(f"不支持的批量输入：{source}（需要 ZIP 文件或目录）")
+
+    input_dir = os.path.join(work_dir, 'input')
+    with zipfile.ZipFile(source) as archive:
+        for member in archive.infolist():
+            name = os.path.normpath(member.filename)
+            # 跳过目录、非图片以及越出解压目录的路径
+            if member.is_dir() or not _is_image(name) or os.path.isabs(name) or name.startswith('..'):
+                continue
+            path = os.path.join(input_dir, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with archive.open(member) as src, open(path, 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+            images.append((name, path))
+    return sorted(images)
+
+
+def _init_worker(ocr_threads):
+    """
+    进程池子进程的初始化：使用子进程自己的 OCR 后端（首次使用时创建），
+    并限制其线程数，使 进程数 × OCR 线程数 不超过 CPU 核数。
+    """
+    image_editor.OCR_POOL_WORKERS = ocr_threads
+    image_editor.set_ocr_backend(None)
+
+
+def _edit_one(name, input_path, output_path, spec):
+    """
+    进程池中执行的单张图片编辑任务。
+    :return: 处理结果字典（文件名、状态、耗时、未找到的文字或错误信息）
+    """
+    started = time.perf_counter()
+    result = {'file': name}
+    try:
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        missing = edit_image(input_path, output_path, spec['replacements'], spec['colors'],
+                             region=spec['region'], preprocess=spec['preprocess'])
+        result.update({'status': 'ok', 'missing_text': missing})
+    except Exception as e:
+        result.update({'status': 'error', 'error': str(e)})
+    result['seconds'] = round(time.perf_counter() - started, 3)
+    return result
+
+
+def _print_progress(done, total, result):
+    """默认的进度输出"""
+    if result['status'] == 'ok':
+        print(f"[DEBUG] [{done}/{total}] {result['file']} 完成，耗时 {result['seconds']}s")
+    else:
+        print(f"[ERROR] [{done}/{total}] {result['file']} 失败：{result['error']}")
+
+
+def run_batch(source, spec, output_zip, workers=None, progress=_print_progress):
+    """
+    批量编辑 ZIP 或目录中的图片，把结果和处理报告打包为 ZIP。
+    :param source: ZIP 文件路径或目录路径
+    :param spec: 编辑规则，见 load_edit_spec
+    :param output_zip: 结果 ZIP 路径
+    :param workers: 进程数，None 表示 CPU 核数
+    :param progress: 每完成一个文件时调用的回调 progress(已完成数, 总数, 结果字典)
+    :return: 处理报告字典
+    """
+    spec = load_edit_spec(spec)
+    started = time.perf_counter()
+    work_dir = tempfile.mkdtemp(prefix='batch_edit_')
+    try:
+        images = collect_images(source, work_dir)
+        output_dir = os.path.join(work_dir, 'output')
+        results = []
+
+        # 使用 spawn 启动子进程：fork 会复制父进程中已创建的 OCR 工作池，但不会复制其工作线程，
+        # 子进程提交 OCR 任务后将永远等待
+        workers = workers or os.cpu_count() or 1
+        ocr_threads = max(1, min(image_editor.OCR_POOL_WORKERS, (os.cpu_count() or 1) // workers))
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=_init_worker, initargs=(ocr_threads,)) as executor:
+            futures = [
+                executor.submit(_edit_one, name, path, os.path.join(output_dir, name), spec)
+                for name, path in images
+            ]
+            for future in as_completed(futures):
+                result = future.result()
+                results.append(result)
+                if progress:
+                    progress(len(results), len(images), result)
+
+        results.sort(key=lambda item: item['file'])
+        report = {
+            'total': len(images),
+            'succeeded': sum(1 for item in results if item['status'] == 'ok'),
+            'failed': sum(1 for item in results if item['status'] != 'ok'),
+            'seconds': round(time.perf_counter() - started, 3),
+            'files': results,
+        }
+
+        with zipfile.ZipFile(output_zip, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for item in results:
+                if item['status'] == 'ok':
+                    archive.write(os.path.join(output_dir, item['file']), item['file'])
+            archive.writestr(REPORT_FILENAME, json.dumps(report, ensure_ascii=False, indent=2))
+        return report
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="批量修改图片中的文字和颜色")
+    parser.add_argument('source', help="包含图片的 ZIP 文件或目录")
+    parser.add_argument('spec', help="编辑规则（JSON 文件路径或 JSON 字符串）")
+    parser.add_argument('-o', '--output', default='batch_results.zip', help="结果 ZIP 路径")
+    parser.add_argument('-j', '--workers', type=int, default=None, help="进程数，默认为 CPU 核数")
+    args = parser.parse_args(argv)
+
+    spec = args.spec
+    if os.path.isfile(spec):
+        with open(spec, 'r', encoding='utf-8') as f:
+            spec = f.read()
+    try:
+        report = run_batch(args.source, spec, args.output, args.workers)
+    except ValueError as e:
+        # 规则或输入格式错误：只输出原因，与网页接口返回 400 对应
+        print(f"[ERROR] {e}")
+        return 2
+    print(f"[DEBUG] 批量处理完成：成功 {report['succeeded']}，失败 {report['failed']}，"
+          f"总耗时 {report['seconds']}s，结果已保存到 {args.output}")
+    return 0 if not report['failed'] else 1
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
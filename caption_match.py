@@ -0,0 +1,94 @@
+import math
+import re
+from bisect import bisect_left
+
+# 图号匹配规则：'Fig. 1.1'、'Figure 1.2'、'图1.1'、'图2'，所有规则合并为一个预编译的正则
+FIGURE_PATTERN = re.compile(
+    r"Fig(?:ure)?\.?\s?\d+(?:\.\d+)?"  # 匹配 'Fig. 1.1' 或 'Figure 1.2'
+    r"|图\d+(?:\.\d+)?",              # 匹配 '图1.1' 或 '图2'
+    re.IGNORECASE,
+)
+
+
+def find_figure_number(text):
+    """
+    从文本中查找第一个图号。
+    :param text: 文本
+    :return: 图号字符串或 None
+    """
+    match = FIGURE_PATTERN.search(text or "")
+    return match.group(0) if match else None
+
+
+def rect_distance(a, b):
+    """两个矩形 (x0, y0, x1, y1) 之间的最短距离，相交时为 0"""
+    dx = max(0, b[0] - a[2], a[0] - b[2])
+    dy = max(0, b[1] - a[3], a[1] - b[3])
+    return math.hypot(dx, dy)
+
+
+class CaptionIndex:
+    """
+    单页的图注空间索引：一次遍历页面中的文本块，找出包含图号的块，
+    按纵坐标排序后即可为每张图片查找几何距离最近的图注。
+    """
+
+    def __init__(self, blocks):
+        """
+        :param blocks: 可迭代的 (矩形 (x0, y0, x1, y1) 或 None, 文本)；没有位置的文本块只在页面中没有其他图注时使用
+        """
+        captions = []
+        self.unplaced = None
+        for bbox, text in blocks:
+            label = find_figure_number(text)
+            if label is None:
+                continue
+            if bbox is None:
+                if self.unplaced is None:
+                    self.unplaced = label
+                continue
+            captions.append((bbox[1], tuple(bbox), label))
+        captions.sort(key=lambda caption: caption[0])
+        self._tops = [caption[0] for caption in captions]
+        self._captions = [(bbox, label) for _, bbox, label in captions]
+        self._max_height = max((bbox[3] - bbox[1] for bbox, _ in self._captions), default=0)
+
+    def __len__(self):
+        return len(self._captions) + (self.unplaced is not None)
+
+    def first(self):
+        """页面中按阅读顺序（自上而下）的第一个图注"""
+        if self._captions:
+            return self._captions[0][1]
+        return self.unplaced
+
+    def nearest(self, bbox):
+        """
+        查找距离矩形最近的图注。距离相同时优先选择位于图片下方的图注。
+        :param bbox: 图片矩形 (x0, y0, x1, y1)，None 时返回第一个图注
+        :return: 图号字符串或 None
+        """
+        if bbox is None or not self._captions:
+            return self.first()
+
+        best, best_key = None, None
+
+        def consider(i):
+            nonlocal best, best_key
+            caption_bbox, label = self._captions[i]
+            key = (rect_distance(bbox, caption_bbox), caption_bbox[1] < bbox[1])
+            if best_key is None or key < best_key:
+                best, best_key = label, key
+
+        # 顶部位于图片顶部或其下方的图注：顶部单调递增，纵向间距超过当前最优距离后即可停止
+        start = bisect_left(self._tops, bbox[1])
+        for i in range(start, len(self._captions)):
+            if best_key is not None and self._tops[i] - bbox[3] > best_key[0]:
+                break
+            consider(i)
+        # 顶部位于图片顶部上方的图注：底部不超过 顶部 + 最大块高度，据此剪枝
+        for i in range(start - 1, -1, -1):
+            if best_key is not None and bbox[1] - (self._tops[i] + self._max_height) > best_key[0]:
+                break
+            consider(i)
+        return best
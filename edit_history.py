@@ -0,0 +1,392 @@
+import hashlib
+import io
+import json
+import os
+import shutil
+import threading
+import uuid
+import zipfile
+from collections import OrderedDict
+
+from PIL import Image
+
+from image_editor import edit_cache_key, edit_image_object, edit_result_cache, file_content_hash
+
+# 编辑历史的保存目录与分块大小（像素）
+HISTORY_FOLDER = 'history'
+HISTORY_TILE_SIZE = 256
+HISTORY_FILENAME = 'history.json'
+# 同一进程内最多为多少个最近使用的编辑历史保留已合成的当前版本和编码结果
+HISTORY_MEMORY_ENTRIES = 4
+# 编辑结果缓存中保存步骤差异的文件扩展名，以及差异包内的步骤信息文件名
+DELTA_EXT = '.zip'
+DELTA_FILENAME = 'step.json'
+
+
+class EditHistory:
+    """
+    写时复制的编辑历史：原图只引用不复制，每一步只保存发生变化的图块（以及调色板），
+    支持撤销/重做，当前版本在查看或下载时才按需合成。
+    """
+
+    def __init__(self, history_dir, base_path=None, tile_size=HISTORY_TILE_SIZE):
+        """
+        :param history_dir: 历史记录目录
+        :param base_path: 原图路径；历史记录不存在时必须提供
+        :param tile_size: 图块边长（像素）
+        """
+        self.history_dir = history_dir
+        self.tiles_dir = os.path.join(history_dir, 'tiles')
+        self._lock = threading.RLock()
+        self._head = None      # (版本号, 图片)
+        self._encoded = None   # (版本号, 格式, 编码后的字节)
+
+        state_path = os.path.join(history_dir, HISTORY_FILENAME)
+        if os.path.isfile(state_path):
+            with open(state_path, 'r', encoding='utf-8') as f:
+                self.state = json.load(f)
+        else:
+            if base_path is None:
+                raise ValueError(f"编辑历史不存在：{history_dir}")
+            self.state = {
+                'base': base_path,
+                'base_hash': file_content_hash(base_path),
+                'tile_size': tile_size,
+                'steps': [],
+                'position': 0,
+            }
+            self._save()
+
+    @property
+    def position(self):
+        """当前版本号（已应用的步骤数）"""
+        return self.state['position']
+
+    @property
+    def steps(self):
+        return self.state['steps']
+
+    def can_undo(self):
+        return self.position > 0
+
+    def can_redo(self):
+        return self.position < len(self.steps)
+
+    def current_step(self):
+        """当前版本对应的步骤，原图时返回 None"""
+        return self.steps[self.position - 1] if self.position else None
+
+    def content_hash(self):
+        """当前版本的内容标识：由原图摘要和已应用步骤的 ID 链计算，无需读取像素"""
+        step_ids = ','.join(step['id'] for step in self.steps[:self.position])
+        return hashlib.sha256(f"{self.state['base_hash']}:{step_ids}".encode()).hexdigest()
+
+    def disk_usage(self):
+        """历史记录占用的磁盘空间（字节，不含原图）"""
+        return sum(step['bytes'] for step in self.steps)
+
+    def _save(self):
+        os.makedirs(self.tiles_dir, exist_ok=True)
+        state_path = os.path.join(self.history_dir, HISTORY_FILENAME)
+        tmp_path = f"{state_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f)
+        os.replace(tmp_path, state_path)
+
+    def _iter_tiles(self, size):
+        tile_size = self.state['tile_size']
+        width, height = size
+        for top in range(0, height, tile_size):
+            for left in range(0, width, tile_size):
+                yield left, top, min(left + tile_size, width), min(top + tile_size, height)
+
+    def _apply_step(self, image, step):
+        """在图片上应用一个步骤的差异"""
+        if tuple(step['size']) != image.size:
+            image = Image.new(step['mode'], tuple(step['size']))
+        elif image.mode != step['mode']:
+            image = image.convert(step['mode'])
+
+        if step.get('palette') is not None:
+            image.putpalette(step['palette'])
+        transparency = step.get('transparency')
+        if isinstance(transparency, list):
+            transparency = bytes(transparency)
+        if transparency is not None:
+            image.info['transparency'] = transparency
+        else:
+            image.info.pop('transparency', None)
+
+        for left, top, name in step['tiles']:
+            with Image.open(os.path.join(self.tiles_dir, name)) as tile:
+                tile.load()
+                image.paste(tile, (left, top))
+        return image
+
+    def _build(self, position):
+        """合成指定版本的图片；当前版本会被缓存，返回的对象不得修改"""
+        if self._head is not None and self._head[0] == position:
+            return self._head[1]
+
+        image = Image.open(self.state['base'])
+        image.load()
+        for step in self.steps[:position]:
+            image = self._apply_step(image, step)
+
+        if position == self.position:
+            self._head = (position, image)
+        return image
+
+    def materialize(self, position=None):
+        """
+        合成指定版本的图片。
+        :param position: 版本号，None 表示当前版本
+        :return: PIL 图片对象（副本，可直接修改）
+        """
+        with self._lock:
+            return self._build(self.position if position is None else position).copy()
+
+    def encode(self, image_format='PNG'):
+        """
+        以指定格式编码当前版本（结果在内存中缓存，直到版本变化）。
+        :return: 编码后的字节
+        """
+        with self._lock:
+            if self._encoded is not None and self._encoded[:2] == (self.position, image_format):
+                return self._encoded[2]
+
+            image = self._build(self.position)
+            if image_format.upper() == 'JPEG' and image.mode in ('RGBA', 'P'):
+                image = image.convert('RGB')
+            buffer = io.BytesIO()
+            image.save(buffer, image_format)
+            self._encoded = (self.position, image_format, buffer.getvalue())
+            return self._encoded[2]
+
+    def _discard_redo(self):
+        """提交新步骤前丢弃当前版本之后的步骤及其图块"""
+        for step in self.steps[self.position:]:
+            for _, _, name in step['tiles']:
+                try:
+                    os.remove(os.path.join(self.tiles_dir, name))
+                except OSError:
+                    pass
+        del self.steps[self.position:]
+
+    def _changed_tiles(self, current, image):
+        """逐个图块比较两个版本，返回发生变化的图块；每次只裁剪一个图块，不复制整张图片"""
+        if image.size != current.size:
+            return list(self._iter_tiles(image.size))
+        changed = []
+        for box in self._iter_tiles(image.size):
+            before = current.crop(box)
+            if before.mode != image.mode:
+                before = before.convert(image.mode)
+            if before.tobytes() != image.crop(box).tobytes():
+                changed.append(box)
+        return changed
+
+    def commit(self, image, description=''):
+        """
+        提交新版本，只保存与当前版本相比发生变化的图块。
+        提交后 image 会作为当前版本被缓存，调用方不应再修改它。
+        :param image: 新版本的图片
+        :param description: 步骤说明
+        :return: 新步骤字典；没有任何变化时返回 None
+        """
+        with self._lock:
+            current = self._build(self.position)
+            step_id = uuid.uuid4().hex
+            palette = image.getpalette() if image.mode == 'P' else None
+            transparency = image.info.get('transparency')
+            if isinstance(transparency, bytes):
+                transparency = list(transparency)
+
+            changed = self._changed_tiles(current, image)
+
+            current_palette = current.getpalette() if current.mode == 'P' else None
+            current_transparency = current.info.get('transparency')
+            if isinstance(current_transparency, bytes):
+                current_transparency = list(current_transparency)
+            if (not changed and image.mode == current.mode and palette == current_palette
+                    and transparency == current_transparency):
+                print("[DEBUG] 编辑历史：图片没有变化，不记录新步骤")
+                return None
+
+            self._discard_redo()
+            os.makedirs(self.tiles_dir, exist_ok=True)
+            tiles = []
+            written = 0
+            for box in changed:
+                name = f"{step_id}_{box[0]}_{box[1]}.png"
+                path = os.path.join(self.tiles_dir, name)
+                image.crop(box).save(path)
+                written += os.path.getsize(path)
+                tiles.append([box[0], box[1], name])
+
+            step = {
+                'id': step_id,
+                'description': description,
+                'size': list(image.size),
+                'mode': image.mode,
+                'palette': palette,
+                'transparency': transparency,
+                'tiles': tiles,
+                'bytes': written,
+            }
+            return self._append_step(step, image)
+
+    def _append_step(self, step, image):
+        """记录新步骤，并把 image 缓存为当前版本"""
+        self.steps.append(step)
+        self.state['position'] = len(self.steps)
+        self._save()
+
+        self._head = (self.position, image)
+        self._encoded = None
+        print(f"[DEBUG] 编辑历史：记录第 {self.position} 步，变化图块 {len(step['tiles'])} 个，"
+              f"写入 {step['bytes']} 字节")
+        return step
+
+    def export_step(self, step, path):
+        """
+        把步骤的差异（变化的图块及尺寸、模式、调色板）打包为 ZIP，供编辑结果缓存保存。
+        :param step: commit 返回的步骤字典，None 表示编辑没有产生变化
+        :param path: ZIP 文件路径
+        """
+        delta = None
+        with zipfile.ZipFile(path, 'w', zipfile.ZIP_STORED) as archive:
+            if step is not None:
+                delta = {name: step[name] for name in ('size', 'mode', 'palette', 'transparency')}
+                delta['tiles'] = [[left, top] for left, top, _ in step['tiles']]
+                for left, top, name in step['tiles']:
+                    archive.write(os.path.join(self.tiles_dir, name), f"{left}_{top}.png")
+            archive.writestr(DELTA_FILENAME, json.dumps(delta))
+
+    def commit_delta(self, path, description=''):
+        """
+        把 export_step 生成的差异作为新版本提交，不需要重新编辑或逐块比较。
+        差异必须是在当前版本上生成的（编辑结果缓存的键包含 content_hash()）。
+        :param path: 差异 ZIP 路径
+        :param description: 步骤说明
+        :return: 新步骤字典；差异为空时返回 None
+        """
+        with self._lock, zipfile.ZipFile(path) as archive:
+            delta = json.loads(archive.read(DELTA_FILENAME))
+            if delta is None:
+                print("[DEBUG] 编辑历史：图片没有变化，不记录新步骤")
+                return None
+
+            current = self._build(self.position)
+            step_id = uuid.uuid4().hex
+            self._discard_redo()
+            os.makedirs(self.tiles_dir, exist_ok=True)
+            tiles = []
+            written = 0
+            for left, top in delta['tiles']:
+                name = f"{step_id}_{left}_{top}.png"
+                tile_path = os.path.join(self.tiles_dir, name)
+                with archive.open(f"{left}_{top}.png") as src, open(tile_path, 'wb') as dst:
+                    shutil.copyfileobj(src, dst)
+                written += os.path.getsize(tile_path)
+                tiles.append([left, top, name])
+
+            step = dict(delta, id=step_id, description=description, tiles=tiles, bytes=written)
+            return self._append_step(step, self._apply_step(current.copy(), step))
+
+    def commit_edit(self, description='', cache=None, **edit_options):
+        """
+        在当前版本上执行编辑并提交，步骤差异同时保存到编辑结果缓存。
+        在相同版本上重复提交相同的编辑时直接使用缓存的差异，不再执行 OCR、绘制和编码。
+        :param description: 步骤说明
+        :param cache: EditResultCache 对象，默认使用全局缓存
+        :param edit_options: 传给 edit_image_object 的编辑参数
+        :return: (新步骤字典或 None, 是否命中缓存)
+        """
+        cache = cache or edit_result_cache
+        key_options = {name: value for name, value in edit_options.items()
+                       if name not in ('intermediate_path', 'memory_budget')}
+        with self._lock:
+            content_hash = self.content_hash()
+            key = edit_cache_key(content_hash, **key_options)
+            cached = cache.get(key, DELTA_EXT)
+            if cached is not None:
+                try:
+                    step = self.commit_delta(cached[0], description)
+                    print(f"[DEBUG] 编辑结果缓存命中：{cached[0]}")
+                    return step, True
+                except (OSError, KeyError, ValueError, zipfile.BadZipFile) as e:
+                    print(f"[WARNING] 编辑结果缓存无法使用，重新编辑：{e}")
+
+            edited, missing = edit_image_object(self.materialize(), content_hash=content_hash, **edit_options)
+            step = self.commit(edited, description)
+
+            def produce(tmp_path):
+                self.export_step(step, tmp_path)
+                return missing
+
+            cache.put(key, DELTA_EXT, produce)
+            return step, False
+
+    def undo(self):
+        """撤销一步，成功时返回 True"""
+        with self._lock:
+            if not self.can_undo():
+                return False
+            self.state['position'] -= 1
+            self._save()
+            return True
+
+    def redo(self):
+        """重做一步，成功时返回 True"""
+        with self._lock:
+            if not self.can_redo():
+                return False
+            self.state['position'] += 1
+            self._save()
+            return True
+
+    def release(self):
+        """释放内存中缓存的当前版本和编码结果，下次使用时重新合成"""
+        with self._lock:
+            self._head = None
+            self._encoded = None
+
+    def delete(self):
+        """删除整个历史记录（不删除原图）"""
+        with self._lock:
+            shutil.rmtree(self.history_dir, ignore_errors=True)
+            self._head = None
+            self._encoded = None
+
+
+_histories = OrderedDict()
+_histories_lock = threading.Lock()
+
+
+def get_history(name, base_path=None, history_folder=HISTORY_FOLDER, reset=False):
+    """
+    获取（或创建）某张上传图片的编辑历史，同一进程内复用同一个对象。
+    :param name: 历史记录名称（通常为上传的文件名）
+    :param base_path: 原图路径，创建新历史时使用
+    :param history_folder: 历史记录根目录
+    :param reset: 为 True 时丢弃已有历史，从 base_path 重新开始
+    :return: EditHistory 对象
+    """
+    history_dir = os.path.join(history_folder, name)
+    with _histories_lock:
+        history = _histories.get(history_dir)
+        if reset:
+            if history is None and os.path.isdir(history_dir):
+                history = EditHistory(history_dir)
+            if history is not None:
+                history.delete()
+            history = None
+        if history is None:
+            history = EditHistory(history_dir, base_path)
+            _histories[history_dir] = history
+        # 只有最近使用的几个历史保留整张图片，其余的释放，避免内存随上传数量增长
+        _histories.move_to_end(history_dir)
+        for stale in list(_histories.values())[:-HISTORY_MEMORY_ENTRIES]:
+            stale.release()
+        return history
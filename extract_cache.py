@@ -0,0 +1,241 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import time
+
+# 提取结果缓存的索引文件名、每个条目的结果文件名与提取图片目录的磁盘占用上限（字节）
+EXTRACT_CACHE_INDEX = 'cache_index.json'
+EXTRACT_RESULTS_FILENAME = 'results.ndjson'
+EXTRACT_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+# 缓存命中只在内存中刷新最近使用时间，至少间隔该时间（秒）才写回索引文件
+EXTRACT_INDEX_SAVE_INTERVAL = 60
+# 上传文件分块读取的大小（字节）
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# 启动时清理未登记的条目目录：只清理缓存键形式的目录，且结果文件至少这么久（秒）没有写入，
+# 以免删除其他进程正在写入的条目
+EXTRACT_ORPHAN_MIN_AGE = 3600
+
+_CACHE_KEY_PATTERN = re.compile(r"[0-9a-f]{32}")
+
+
+def save_stream_with_hash(stream, path, chunk_size=UPLOAD_CHUNK_SIZE):
+    """
+    边读取边写入文件，同时计算内容的 SHA-256 摘要，不需要再次读取文件。
+    :param stream: 可读的二进制流（如上传文件的 stream）
+    :param path: 保存路径
+    :return: 十六进制摘要字符串
+    """
+    digest = hashlib.sha256()
+    with open(path, 'wb') as f:
+        for chunk in iter(lambda: stream.read(chunk_size), b''):
+            digest.update(chunk)
+            f.write(chunk)
+    return digest.hexdigest()
+
+
+def file_sha256(path, chunk_size=UPLOAD_CHUNK_SIZE):
+    """计算文件内容的 SHA-256 摘要"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def extract_cache_key(doc_hash, pages=None, options=None):
+    """
+    由文档内容摘要、页码集合和提取选项生成缓存键。
+    :param pages: 规范化的页码集合（PageRangeSet），None 表示所有页
+    :param options: 影响提取结果的其他选项字典，值为 None 的选项忽略
+    """
+    page_spec = repr(pages) if pages else 'all'
+    options = {name: value for name, value in (options or {}).items() if value is not None}
+    if options:
+        page_spec += ':' + json.dumps(options, sort_keys=True)
+    return hashlib.sha256(f"{doc_hash}:{page_spec}".encode()).hexdigest()[:32]
+
+
+def _directory_size(directory):
+    total = 0
+    for root, _, files in os.walk(directory):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def read_results(path):
+    """逐行读取结果文件（NDJSON），逐条产出结果字典"""
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+class ExtractionCache:
+    """
+    提取结果缓存：每个条目对应 root_dir 下的一个图片目录，结果逐条写入目录中的 results.ndjson。
+    索引文件只记录每个条目的图片数、目录大小和最近使用时间，按总大小淘汰最久未使用的目录。
+    """
+
+    def __init__(self, root_dir, max_bytes=EXTRACT_CACHE_MAX_BYTES, save_interval=EXTRACT_INDEX_SAVE_INTERVAL):
+        """
+        :param root_dir: 提取图片的根目录（每个缓存条目一个子目录）
+        :param max_bytes: 所有条目目录的总大小上限
+        :param save_interval: 缓存命中后写回索引文件的最小间隔（秒）
+        """
+        self.root_dir = root_dir
+        self.max_bytes = max_bytes
+        self.save_interval = save_interval
+        self.index_path = os.path.join(root_dir, EXTRACT_CACHE_INDEX)
+        self._lock = threading.Lock()
+        self._finished = threading.Condition(self._lock)  # 有条目写完（登记或删除）时通知
+        self._index = None
+        self._pending = set()  # 正在写入的条目
+        self._dirty = False
+        self._saved_at = 0
+
+    def entry_dir(self, key):
+        """缓存条目的图片目录"""
+        return os.path.join(self.root_dir, key)
+
+    def results_path(self, key):
+        """缓存条目的结果文件"""
+        return os.path.join(self.entry_dir(key), EXTRACT_RESULTS_FILENAME)
+
+    def _load(self):
+        if self._index is None:
+            try:
+                with open(self.index_path, 'r', encoding='utf-8') as f:
+                    self._index = json.load(f)
+            except (OSError, ValueError):
+                self._index = {}
+            self._remove_orphans()
+        return self._index
+
+    def _remove_orphans(self):
+        """
+        删除索引中没有记录的条目目录（例如进程在提取途中退出时留下的目录）。
+        只处理由本缓存创建的目录：名称是缓存键、包含结果文件，且结果文件已有一段时间没有写入。
+        """
+        if not os.path.isdir(self.root_dir):
+            return
+        now = time.time()
+        for entry in os.scandir(self.root_dir):
+            if (not entry.is_dir() or not _CACHE_KEY_PATTERN.fullmatch(entry.name)
+                    or entry.name in self._index or entry.name in self._pending):
+                continue
+            try:
+                modified = os.path.getmtime(os.path.join(entry.path, EXTRACT_RESULTS_FILENAME))
+            except OSError:
+                continue
+            if now - modified >= EXTRACT_ORPHAN_MIN_AGE:
+                print(f"[WARNING] 删除未登记的提取目录：{entry.path}")
+                shutil.rmtree(entry.path, ignore_errors=True)
+
+    def _save(self):
+        os.makedirs(self.root_dir, exist_ok=True)
+        tmp_path = f"{self.index_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._index, f)
+        os.replace(tmp_path, self.index_path)
+        self._dirty = False
+        self._saved_at = time.monotonic()
+
+    def _lookup(self, key):
+        """在已持有锁时查找条目，返回结果文件路径或 None"""
+        entry = self._load().get(key)
+        if entry is None:
+            return None
+        path = self.results_path(key)
+        if not os.path.isfile(path):
+            del self._index[key]
+            self._save()
+            return None
+        # 最近使用时间只在内存中刷新，按间隔写回
+        entry['used'] = time.time()
+        self._dirty = True
+        if time.monotonic() - self._saved_at >= self.save_interval:
+            self._save()
+        return path
+
+    def get(self, key):
+        """
+        查找缓存的提取结果。
+        :return: 结果文件路径（用 read_results 逐条读取），未命中（或文件已被删除）时返回 None
+        """
+        with self._lock:
+            return self._lookup(key)
+
+    def claim(self, key):
+        """
+        查找缓存的提取结果，未命中时把条目登记为正在写入，由调用方负责提取。
+        同一条目正在被其他请求写入时先等待其完成，避免两次提取写入同一目录。
+        :return: 命中时返回结果文件路径；返回 None 时调用方必须写入（writer）后调用 put 或 discard
+        """
+        with self._lock:
+            while key in self._pending:
+                self._finished.wait()
+            path = self._lookup(key)
+            if path is None:
+                self._pending.add(key)
+            return path
+
+    def writer(self, key):
+        """
+        打开条目的结果文件（条目须已通过 claim 登记），提取时逐条写入（每行一个 JSON），写完后调用 put 登记。
+        :return: 可写的文本文件对象
+        """
+        os.makedirs(self.entry_dir(key), exist_ok=True)
+        return open(self.results_path(key), 'w', encoding='utf-8')
+
+    def discard(self, key):
+        """
+        删除未完成的条目（提取失败或客户端断开时调用），避免留下索引之外、无法被淘汰的目录。
+        """
+        with self._lock:
+            if self._load().pop(key, None) is not None:
+                self._save()
+            shutil.rmtree(self.entry_dir(key), ignore_errors=True)
+            self._pending.discard(key)
+            self._finished.notify_all()
+        print(f"[DEBUG] 已删除未完成的提取结果：{key}")
+
+    def put(self, key, count):
+        """
+        登记已写好的条目（图片和结果文件都在 entry_dir(key) 中），并按总大小淘汰旧条目。
+        :param count: 图片数
+        :return: 被淘汰的条目数
+        """
+        size = _directory_size(self.entry_dir(key))
+        with self._lock:
+            index = self._load()
+            self._pending.discard(key)
+            index[key] = {'count': count, 'bytes': size, 'used': time.time()}
+            removed = self._evict(keep=key)
+            self._save()
+            self._finished.notify_all()
+        print(f"[DEBUG] 提取结果已缓存：{key}（{count} 张图片，{size} 字节）")
+        return removed
+
+    def _evict(self, keep=None):
+        """淘汰最久未使用的条目，直到总大小不超过上限（不淘汰 keep）"""
+        total = sum(entry['bytes'] for entry in self._index.values())
+        removed = 0
+        for key, entry in sorted(self._index.items(), key=lambda item: item[1]['used']):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(self.entry_dir(key), ignore_errors=True)
+            del self._index[key]
+            total -= entry['bytes']
+            removed += 1
+        if removed:
+            print(f"[DEBUG] 提取结果缓存淘汰了 {removed} 个条目")
+        return removed
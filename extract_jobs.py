@@ -0,0 +1,181 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+# 任务数据库路径、默认并发数以及进度写入的最小间隔（秒）
+JOBS_DB = 'jobs/extract_jobs.sqlite3'
+JOB_WORKERS = 2
+PROGRESS_INTERVAL = 0.5
+
+# 任务状态
+QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    file_path TEXT NOT NULL,
+    file_ext TEXT NOT NULL,
+    pages TEXT NOT NULL DEFAULT '',
+    progress INTEGER NOT NULL DEFAULT 0,
+    results TEXT,
+    error TEXT,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL
+)
+"""
+
+
+class ExtractionJobQueue:
+    """
+    后台提取任务队列：任务保存在 SQLite 中，由固定数量的工作线程按提交顺序处理。
+    进程重启后，未完成（排队中或运行中）的任务会重新排队执行。
+    """
+
+    def __init__(self, runner, db_path=JOBS_DB, workers=JOB_WORKERS):
+        """
+        :param runner: 执行提取的函数 runner(file_path, file_ext, pages)，返回逐张产出结果字典的可迭代对象
+        :param db_path: SQLite 数据库路径
+        :param workers: 同时运行的任务数上限
+        """
+        self.runner = runner
+        self.db_path = db_path
+        self.workers = max(1, workers)
+        self._changed = threading.Condition()
+        self._threads = []
+
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(_SCHEMA)
+            # 上次退出时仍在运行的任务重新排队
+            recovered = conn.execute("UPDATE jobs SET status = ?, progress = 0, started = NULL WHERE status = ?",
+                                     (QUEUED, RUNNING)).rowcount
+        if recovered:
+            print(f"[WARNING] {recovered} 个未完成的提取任务已重新排队")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _update(self, job_id, **fields):
+        """更新任务字段并通知等待中的订阅者"""
+        columns = ', '.join(f"{name} = ?" for name in fields)
+        with self._connect() as conn:
+            conn.execute(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+        with self._changed:
+            self._changed.notify_all()
+
+    def start(self):
+        """启动工作线程（重复调用不会重复启动）"""
+        if self._threads:
+            return self
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"extract-job-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def submit(self, file_path, file_ext, pages=''):
+        """
+        提交提取任务。
+        :param file_path: 已保存的 PDF/PPTX 路径
+        :param file_ext: 扩展名（'.pdf' 或 '.pptx'）
+        :param pages: 页码范围输入，如 "1,3-5"
+        :return: 任务 ID
+        """
+        job_id = uuid.uuid4().hex
+        with self._connect() as conn:
+            conn.execute("INSERT INTO jobs (id, status, file_path, file_ext, pages, created) VALUES (?, ?, ?, ?, ?, ?)",
+                         (job_id, QUEUED, file_path, file_ext, pages or '', time.time()))
+        with self._changed:
+            self._changed.notify_all()
+        print(f"[DEBUG] 提取任务 {job_id} 已排队：{file_path}")
+        return job_id
+
+    def get(self, job_id, with_results=False):
+        """
+        查询任务状态。
+        :param with_results: 是否附带提取结果（仅在任务完成后有内容）
+        :return: 任务信息字典，任务不存在时返回 None
+        """
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            position = None
+            if row is not None and row['status'] == QUEUED:
+                position = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = ? AND created < ?",
+                                        (QUEUED, row['created'])).fetchone()[0]
+        if row is None:
+            return None
+
+        job = {key: row[key] for key in row.keys() if key != 'results'}
+        job['queue_position'] = position
+        if with_results:
+            job['results'] = json.loads(row['results']) if row['results'] else []
+        return job
+
+    def wait(self, job_id, last=None, timeout=15):
+        """
+        等待任务状态或进度发生变化，用于订阅推送。
+        :param last: 上一次得到的任务信息，None 时立即返回当前状态
+        :param timeout: 最长等待时间（秒），超时后返回当前状态
+        :return: 任务信息字典，任务不存在时返回 None
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            job = self.get(job_id)
+            if job is None or last is None or (job['status'], job['progress']) != (last['status'], last['progress']):
+                return job
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return job
+            with self._changed:
+                self._changed.wait(min(remaining, PROGRESS_INTERVAL * 2))
+
+    def _claim(self):
+        """按提交顺序取出一个排队中的任务并标记为运行中"""
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT * FROM jobs WHERE status = ? ORDER BY created LIMIT 1", (QUEUED,)).fetchone()
+            if row is not None:
+                conn.execute("UPDATE jobs SET status = ?, started = ? WHERE id = ?", (RUNNING, time.time(), row['id']))
+        return row
+
+    def _work(self):
+        """工作线程主循环"""
+        while True:
+            row = self._claim()
+            if row is None:
+                with self._changed:
+                    self._changed.wait(PROGRESS_INTERVAL * 2)
+                continue
+            with self._changed:
+                self._changed.notify_all()
+            self._run(row)
+
+    def _run(self, row):
+        """执行单个任务，运行期间按间隔写入进度"""
+        job_id = row['id']
+        print(f"[DEBUG] 开始执行提取任务 {job_id}")
+        results = []
+        last_report = time.monotonic()
+        try:
+            for result in self.runner(row['file_path'], row['file_ext'], row['pages']):
+                results.append(result)
+                if time.monotonic() - last_report >= PROGRESS_INTERVAL:
+                    self._update(job_id, progress=len(results))
+                    last_report = time.monotonic()
+        except Exception as e:
+            print(f"[ERROR] 提取任务 {job_id} 失败：{e}")
+            self._update(job_id, status=FAILED, progress=len(results), error=str(e), finished=time.time())
+            return
+
+        self._update(job_id, status=DONE, progress=len(results), finished=time.time(),
+                     results=json.dumps(results, ensure_ascii=False))
+        print(f"[DEBUG] 提取任务 {job_id} 完成，共 {len(results)} 张图片")
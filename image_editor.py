@@ -1,51 +1,694 @@
+import hashlib
+import json
+import math
+import os
+import queue
+import shlex
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from functools import lru_cache
+
+import numpy as np
 import pytesseract
-from PIL import Image, ImageDraw, ImageFont, ImageFilter, ImageOps
+from PIL import Image, ImageDraw, ImageFont
+
+try:
+    import tesserocr  # 可选依赖：常驻内存的 Tesseract API
+except ImportError:
+    tesserocr = None
 
 
 # 确保 Tesseract OCR 安装并配置好路径
 pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
 
-def replace_line_color(input_path, target_color, replacement_color, output_path):
+# 超过该像素数量的图片自动使用分块模式进行颜色替换
+TILED_PIXEL_THRESHOLD = 25_000_000
+# 分块模式下工作缓冲区的默认内存预算（字节）
+DEFAULT_MEMORY_BUDGET = 256 * 1024 * 1024
+# 分块处理时每个像素的大致工作内存：RGBA 缓冲、距离/差值数组、HSV 及回写副本
+_TILE_BYTES_PER_PIXEL = 24
+
+# OCR 结果缓存：内存 LRU 条目数、磁盘目录及磁盘占用上限（字节）
+OCR_CACHE_DIR = os.path.join('cache', 'ocr')
+OCR_CACHE_MEMORY_ENTRIES = 128
+OCR_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# 编辑结果缓存：按原图内容和编辑参数寻址，磁盘占用上限（字节）
+EDIT_CACHE_DIR = os.path.join('cache', 'edits')
+EDIT_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+# OCR 后端：'auto' 优先使用常驻工作池，不可用时退回 pytesseract
+OCR_BACKEND = os.environ.get('OCR_BACKEND', 'auto')
+OCR_POOL_WORKERS = max(1, min(4, os.cpu_count() or 1))
+OCR_POOL_QUEUE_SIZE = 32
+OCR_DEFAULT_LANG = 'eng'
+
+# 字体对象与文字尺寸测量的缓存大小，以及字号搜索上限
+FONT_CACHE_SIZE = 256
+TEXT_MEASURE_CACHE_SIZE = 4096
+MAX_FONT_SIZE = 1024
+FONT_SIZE_JITTER = 3
+
+# 颜色估计：直方图量化位数，以及文字色与背景色的最小差值（RGB 各通道差值之和）
+COLOR_QUANT_BITS = 5
+TEXT_COLOR_DISTANCE = 80
+
+# OCR 预处理的默认参数：缩放到目标文字高度、二值化、可选的倾斜校正
+OCR_PREPROCESS_DEFAULTS = {
+    'target_text_height': 32,   # 目标文字行高（像素）
+    'min_scale': 0.25,
+    'max_scale': 4.0,
+    'max_pixels': 12_000_000,   # 缩放后的像素数上限
+    'binarize': True,
+    'deskew': False,
+    'max_skew_angle': 5.0,      # 倾斜检测范围（度）
+    'skew_step': 0.5,
+}
+# 预处理结果在内存中保留的条目数
+OCR_PREPROCESS_CACHE_ENTRIES = 8
+
+def hex_to_rgba(color, alpha=255):
+    """
+    将十六进制颜色转换为 RGBA 元组。
+    :param color: 颜色字符串 (如 #FF5733)，也可以直接传入 RGB/RGBA 元组
+    :param alpha: 未指定透明度时使用的 alpha 值
+    :return: (r, g, b, a)
+    """
+    if isinstance(color, (tuple, list)):
+        rgba = tuple(int(c) for c in color)
+        return rgba if len(rgba) == 4 else rgba[:3] + (alpha,)
+
+    color = color.strip().lstrip('#')  # 移除 #
+    if len(color) == 3:  # 简写形式 #F53
+        color = ''.join(c * 2 for c in color)
+    if len(color) not in (6, 8):
+        raise ValueError(f"无效的颜色值：'{color}'")
+    rgba = tuple(int(color[i:i+2], 16) for i in range(0, len(color), 2))
+    return rgba if len(rgba) == 4 else rgba + (alpha,)
+
+
+def normalize_color_pairs(color_pairs):
+    """
+    将颜色替换规则统一为字典列表。
+    每条规则可以是 (源颜色, 目标颜色)、(源颜色, 目标颜色, 容差) 或字典：
+    {'source': '#000000', 'target': '#FF5733', 'tolerance': 30, 'mode': 'rgb'}
+    - mode='rgb'：tolerance 为 RGB 空间的欧氏距离（0 表示精确匹配）
+    - mode='hsv'：tolerance 为 (色相, 饱和度, 明度) 的允许偏差，取值范围 0-255
+    :param color_pairs: 颜色替换规则列表
+    :return: 规范化后的规则列表
+    """
+    rules = []
+    for pair in color_pairs:
+        if isinstance(pair, dict):
+            source, target = pair['source'], pair['target']
+            tolerance = pair.get('tolerance', 0)
+            mode = pair.get('mode', 'rgb')
+        else:
+            source, target = pair[0], pair[1]
+            tolerance = pair[2] if len(pair) > 2 else 0
+            mode = pair[3] if len(pair) > 3 else 'rgb'
+
+        mode = mode.lower()
+        if mode not in ('rgb', 'hsv'):
+            raise ValueError(f"不支持的颜色匹配模式：'{mode}'")
+        if mode == 'hsv' and not isinstance(tolerance, (tuple, list)):
+            tolerance = (tolerance, tolerance, tolerance)
+
+        rules.append({
+            'source': hex_to_rgba(source),
+            'target': hex_to_rgba(target),
+            'tolerance': tolerance,
+            'mode': mode,
+        })
+    return rules
+
+
+def _rgb_to_hsv_array(rgb):
+    """将 (H, W, 3) 的 RGB 数组转换为 PIL 的 HSV 表示（各通道 0-255）"""
+    return np.asarray(Image.fromarray(rgb, "RGB").convert("HSV"))
+
+
+def _build_color_mask(rgb, rule, hsv=None):
+    """
+    计算与规则源颜色匹配的像素掩码。
+    :param rgb: (H, W, 3) 的 uint8 数组
+    :param rule: normalize_color_pairs 返回的单条规则
+    :param hsv: 预先计算好的 HSV 数组（mode='hsv' 时使用）
+    :return: (H, W) 的布尔掩码
+    """
+    source = rule['source'][:3]
+    tolerance = rule['tolerance']
+
+    if rule['mode'] == 'hsv':
+        source_hsv = _rgb_to_hsv_array(np.array([[source]], dtype=np.uint8))[0, 0].astype(np.int16)
+        mask = np.ones(rgb.shape[:2], dtype=bool)
+        for channel, band in enumerate(tolerance):
+            diff = np.abs(hsv[..., channel].astype(np.int16) - source_hsv[channel])
+            if channel == 0:  # 色相是环形的
+                diff = np.minimum(diff, 256 - diff)
+            mask &= diff <= band
+        return mask
+
+    if not tolerance:
+        # 精确匹配：逐通道比较，不需要升级数据类型
+        return ((rgb[..., 0] == source[0]) &
+                (rgb[..., 1] == source[1]) &
+                (rgb[..., 2] == source[2]))
+
+    distance = np.zeros(rgb.shape[:2], dtype=np.int32)
+    for channel in range(3):
+        diff = rgb[..., channel].astype(np.int16) - source[channel]
+        distance += diff.astype(np.int32) ** 2
+    return distance <= int(tolerance) ** 2
+
+
+def _match_color_rules(rgb, rules):
+    """
+    基于原始像素计算每条规则的掩码。同一像素命中多条规则时，以列表中靠前的规则为准。
+    :param rgb: (H, W, 3) 的 uint8 数组
+    :param rules: normalize_color_pairs 返回的规则列表
+    :return: 与 rules 一一对应的布尔掩码列表
+    """
+    hsv = _rgb_to_hsv_array(np.ascontiguousarray(rgb)) if any(r['mode'] == 'hsv' for r in rules) else None
+
+    masks = []
+    claimed = np.zeros(rgb.shape[:2], dtype=bool)
+    for rule in rules:
+        mask = _build_color_mask(rgb, rule, hsv)
+        mask &= ~claimed
+        claimed |= mask
+        masks.append(mask)
+    return masks
+
+
+def recolor_array(rgba, color_pairs):
+    """
+    在 RGBA 数组上一次性应用多条颜色替换规则（原地修改）。
+    所有规则都针对原始像素匹配，因此替换结果不会被后续规则再次替换。
+    :param rgba: (H, W, 4) 的 uint8 数组
+    :param color_pairs: 颜色替换规则，格式见 normalize_color_pairs
+    :return: 被替换的像素数量
+    """
+    rules = normalize_color_pairs(color_pairs)
+    if not rules:
+        return 0
+
+    # 先计算全部掩码，再统一写入
+    masks = _match_color_rules(rgba[..., :3], rules)
+    replaced = 0
+    for rule, mask in zip(rules, masks):
+        rgba[mask] = rule['target']
+        replaced += int(mask.sum())
+    return replaced
+
+
+def replace_colors(image, color_pairs):
+    """
+    替换图片对象中的多种颜色。
+    :param image: PIL 图片对象
+    :param color_pairs: 颜色替换规则，格式见 normalize_color_pairs
+    :return: 替换后的 RGBA 图片对象
+    """
+    rgba = np.array(image.convert("RGBA"))
+    recolor_array(rgba, color_pairs)
+    return Image.fromarray(rgba, "RGBA")
+
+
+def replace_palette_colors(image, color_pairs):
+    """
+    调色板模式（"P"，如 GIF / PNG-8）的快速替换：只改写命中的调色板条目，
+    复杂度与调色板大小相关而与像素数量无关，输出仍保持索引格式。
+    :param image: "P" 模式的 PIL 图片对象
+    :param color_pairs: 颜色替换规则，格式见 normalize_color_pairs
+    :return: (替换后的图片对象, 被改写的调色板条目数)
+    """
+    rules = normalize_color_pairs(color_pairs)
+    palette = np.array(image.getpalette() or [], dtype=np.uint8).reshape(-1, 1, 3)
+    if not rules or not len(palette):
+        return image, 0
+
+    masks = _match_color_rules(palette, rules)
+    matched = set()
+    for rule, mask in zip(rules, masks):
+        palette[mask] = rule['target'][:3]
+        matched.update(np.flatnonzero(mask[:, 0]).tolist())
+    if not matched:
+        return image, 0
+
+    result = image.copy()
+    result.putpalette(palette.flatten().tolist())
+
+    # 与 RGBA 路径保持一致：被替换的颜色变为不透明
+    transparency = result.info.get('transparency')
+    if isinstance(transparency, int) and transparency in matched:
+        del result.info['transparency']
+    elif isinstance(transparency, bytes):
+        alpha = bytearray(transparency)
+        for index in matched:
+            if index < len(alpha):
+                alpha[index] = 255
+        result.info['transparency'] = bytes(alpha)
+
+    return result, len(matched)
+
+
+def _iter_tile_boxes(size, rows=None, tile_size=None):
+    """
+    按横向条带或固定大小的方块遍历图片区域。
+    :param size: 图片尺寸 (宽, 高)
+    :param rows: 条带高度（行数）
+    :param tile_size: 方块边长，指定时优先使用
+    :return: (left, top, right, bottom) 生成器
+    """
+    width, height = size
+    if tile_size:
+        for top in range(0, height, tile_size):
+            for left in range(0, width, tile_size):
+                yield left, top, min(left + tile_size, width), min(top + tile_size, height)
+    else:
+        for top in range(0, height, rows):
+            yield 0, top, width, min(top + rows, height)
+
+
+def replace_colors_tiled(image, color_pairs, memory_budget=DEFAULT_MEMORY_BUDGET, tile_size=None):
+    """
+    分块替换颜色：逐条带（或逐方块）转换、替换后写回图片，
+    工作缓冲区的峰值内存不超过 memory_budget，不再额外生成整图的 RGBA 副本。
+    RGB / RGBA 图片会被原地修改；其他模式逐条带转换为 RGBA 后写入新的 RGBA 图片。
+    :param image: PIL 图片对象
+    :param color_pairs: 颜色替换规则，格式见 normalize_color_pairs
+    :param memory_budget: 工作缓冲区的内存预算（字节）
+    :param tile_size: 方块边长；为 None 时按内存预算计算条带高度
+    :return: 替换后的图片对象
+    """
+    rules = normalize_color_pairs(color_pairs)
+    if not rules:
+        return image
+
+    # 其他模式（L、1、CMYK、I;16 等）无法保存替换后的颜色，结果写入 RGBA 图片，每个条带都要写回
+    in_place = image.mode in ("RGB", "RGBA")
+    output = image if in_place else Image.new("RGBA", image.size)
+
+    width, height = image.size
+    bytes_per_pixel = _TILE_BYTES_PER_PIXEL + len(rules)
+    if tile_size:
+        rows = None
+    else:
+        rows = max(1, min(height, memory_budget // (width * bytes_per_pixel)))
+
+    replaced = 0
+    for box in _iter_tile_boxes(image.size, rows, tile_size):
+        tile = np.array(image.crop(box).convert("RGBA"))
+        count = recolor_array(tile, rules)
+        replaced += count
+        if count or not in_place:
+            patch = Image.fromarray(tile, "RGBA")
+            output.paste(patch if output.mode == "RGBA" else patch.convert(output.mode), box[:2])
+
+    print(f"[DEBUG] 分块模式：共替换 {replaced} 个像素")
+    return output
+
+
+def apply_color_pairs(image, color_pairs, keep_palette=True, tiled=None, memory_budget=DEFAULT_MEMORY_BUDGET,
+                      pixel_threshold=TILED_PIXEL_THRESHOLD):
+    """
+    按图片类型选择颜色替换方式：调色板快速路径、分块模式或整图模式。
+    :param image: PIL 图片对象（分块模式下可能被原地修改）
+    :param color_pairs: 颜色替换规则，格式见 normalize_color_pairs
+    :param keep_palette: 调色板图片只改写调色板并保持索引格式
+    :param tiled: 是否分块处理；None 表示像素数超过 pixel_threshold 时自动启用
+    :param memory_budget: 分块模式的内存预算（字节）
+    :param pixel_threshold: 自动启用分块模式的像素数阈值
+    :return: 替换后的图片对象
+    """
+    if tiled is None:
+        tiled = image.size[0] * image.size[1] > pixel_threshold
+
+    if keep_palette and image.mode == "P":
+        image, replaced = replace_palette_colors(image, color_pairs)
+        print(f"[DEBUG] 调色板模式：改写了 {replaced} 个调色板条目")
+        return image
+    if tiled:
+        return replace_colors_tiled(image, color_pairs, memory_budget)
+    return replace_colors(image, color_pairs)
+
+
+def replace_line_color(input_path, target_color, replacement_color, output_path, tolerance=0, mode='rgb',
+                       keep_palette=True, tiled=None, memory_budget=DEFAULT_MEMORY_BUDGET,
+                       pixel_threshold=TILED_PIXEL_THRESHOLD):
     """
     将图片中指定颜色的线条替换为目标颜色
     :param input_path: 输入图片路径
     :param target_color: 要替换的颜色 (如 #000000)
     :param replacement_color: 替换后的颜色 (如 #FF5733)
     :param output_path: 输出图片路径
+    :param tolerance: 颜色容差，0 表示精确匹配
+    :param mode: 容差的计算方式，'rgb' 或 'hsv'
+    :param keep_palette: 调色板图片只改写调色板并以索引格式保存
+    :param tiled: 是否分块处理；None 表示像素数超过 pixel_threshold 时自动启用
+    :param memory_budget: 分块模式的内存预算（字节）
+    :param pixel_threshold: 自动启用分块模式的像素数阈值
     """
-    # 打开图片
-    img = Image.open(input_path).convert("RGBA")
+    img = Image.open(input_path)
+    color_pairs = [{
+        'source': target_color,
+        'target': replacement_color,
+        'tolerance': tolerance,
+        'mode': mode,
+    }]
+    img = apply_color_pairs(img, color_pairs, keep_palette, tiled, memory_budget, pixel_threshold)
 
-    # 将颜色转换为 RGBA 格式
-    target_color = target_color.lstrip('#')  # 移除 #
-    target_rgba = tuple(int(target_color[i:i+2], 16) for i in (0, 2, 4)) + (255,)  # 添加透明度
+    # 保存图片
+    img.save(output_path)
 
-    replacement_color = replacement_color.lstrip('#')  # 移除 #
-    replacement_rgba = tuple(int(replacement_color[i:i+2], 16) for i in (0, 2, 4)) + (255,)
 
-    # 替换颜色
-    data = img.getdata()
-    new_data = []
-    for item in data:
-        if item[:3] == target_rgba[:3]:  # 如果颜色匹配
-            new_data.append(replacement_rgba)  # 替换为新颜色
-        else:
-            new_data.append(item)  # 保留原始像素
+def file_content_hash(path, chunk_size=1024 * 1024):
+    """
+    计算文件内容的 SHA-256 摘要。
+    :param path: 文件路径
+    :param chunk_size: 每次读取的字节数
+    :return: 十六进制摘要字符串
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
 
-    # 更新图片数据
-    img.putdata(new_data)
 
-    # 保存图片
-    img.save(output_path)
+def image_content_hash(image):
+    """
+    计算已解码图片的内容摘要（包含模式与尺寸）。
+    :param image: PIL 图片对象
+    :return: 十六进制摘要字符串
+    """
+    digest = hashlib.sha256(f"{image.mode}:{image.size[0]}x{image.size[1]}:".encode())
+    digest.update(image.tobytes())
+    return digest.hexdigest()
 
-def extract_text_and_boxes(image_path):
+
+def evict_directory(directory, max_bytes):
     """
-    提取图片中的文字及其位置信息。
-    :param image_path: 图片路径
-    :return: OCR 提取的文字和位置信息（字典列表形式）
+    按最近使用时间（mtime）淘汰目录中的文件，直到总大小不超过 max_bytes。
+    :param directory: 缓存目录
+    :param max_bytes: 磁盘占用上限（字节）
+    :return: 被删除的文件数
     """
-    image = Image.open(image_path)
-    ocr_data = pytesseract.image_to_data(image, output_type=pytesseract.Output.DICT)
+    entries = []
+    total = 0
+    for entry in os.scandir(directory):
+        if entry.is_file():
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total += stat.st_size
+
+    removed = 0
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        removed += 1
+    return removed
+
+
+class OCRCache:
+    """
+    OCR 结果缓存：以图片内容摘要和 OCR 参数为键，
+    内存中保留最近使用的条目，同时持久化到磁盘并按总大小淘汰。
+    """
+
+    def __init__(self, cache_dir=OCR_CACHE_DIR, memory_entries=OCR_CACHE_MEMORY_ENTRIES,
+                 max_bytes=OCR_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.memory_entries = memory_entries
+        self.max_bytes = max_bytes
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(content_hash, params):
+        """由内容摘要和 OCR 参数生成缓存键"""
+        encoded = json.dumps(params, sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(f"{content_hash}:{encoded}".encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _remember(self, key, value):
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, key):
+        """读取缓存，未命中时返回 None"""
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key]
+
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                value = json.load(f)
+            os.utime(path)  # 刷新最近使用时间
+        except (OSError, ValueError):
+            return None
+
+        with self._lock:
+            self._remember(key, value)
+        return value
+
+    def set(self, key, value):
+        """写入缓存（内存与磁盘）"""
+        with self._lock:
+            self._remember(key, value)
+
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = f"{self._path(key)}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(value, f, ensure_ascii=False)
+            os.replace(tmp_path, self._path(key))
+            evict_directory(self.cache_dir, self.max_bytes)
+        except OSError as e:
+            print(f"[WARNING] OCR 缓存写入失败：{e}")
+
+    def clear(self):
+        """清空内存与磁盘缓存"""
+        with self._lock:
+            self._memory.clear()
+        if os.path.isdir(self.cache_dir):
+            evict_directory(self.cache_dir, 0)
+
+
+ocr_cache = OCRCache()
+
+
+class PytesseractBackend:
+    """
+    pytesseract 后端：每次调用启动一个 tesseract 进程。
+    作为常驻工作池不可用时的后备方案，并通过信号量限制并发进程数。
+    """
+
+    name = 'pytesseract'
+
+    def __init__(self, max_concurrency=OCR_POOL_WORKERS):
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+
+    def image_to_data(self, image, lang=None, config=''):
+        """返回与 pytesseract.Output.DICT 相同结构的识别结果"""
+        with self._slots:
+            return pytesseract.image_to_data(image, lang=lang, config=config,
+                                             output_type=pytesseract.Output.DICT)
+
+    def close(self):
+        pass
+
+
+class TesserocrPoolBackend:
+    """
+    常驻 OCR 工作池：每个工作线程持有已加载语言模型的 tesserocr API，
+    任务通过有界队列分发，并发数等于工作线程数。
+    """
+
+    name = 'tesserocr'
+
+    def __init__(self, workers=OCR_POOL_WORKERS, queue_size=OCR_POOL_QUEUE_SIZE,
+                 lang=OCR_DEFAULT_LANG, tessdata_path=None, submit_timeout=30):
+        if tesserocr is None:
+            raise RuntimeError("未安装 tesserocr，无法使用常驻 OCR 工作池")
+
+        self.lang = lang
+        self.tessdata_path = tessdata_path
+        self.submit_timeout = submit_timeout
+        self._tasks = queue.Queue(maxsize=queue_size)
+        self._threads = []
+
+        # 预热：等待每个工作线程加载完默认语言模型
+        ready = [threading.Event() for _ in range(workers)]
+        errors = []
+        for i in range(workers):
+            thread = threading.Thread(target=self._worker, args=(ready[i], errors),
+                                      name=f"ocr-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        for event in ready:
+            event.wait()
+        if errors:
+            self.close()
+            raise RuntimeError(f"OCR 工作池初始化失败：{errors[0]}")
+
+    @staticmethod
+    def _parse_config(config):
+        """将 pytesseract 风格的参数拆分为页面分割模式和变量"""
+        psm = None
+        variables = []
+        args = shlex.split(config or '')
+        i = 0
+        while i < len(args):
+            if args[i] == '--psm' and i + 1 < len(args):
+                psm = int(args[i + 1])
+                i += 1
+            elif args[i] == '-c' and i + 1 < len(args):
+                name, _, value = args[i + 1].partition('=')
+                variables.append((name, value))
+                i += 1
+            i += 1
+        return psm, tuple(sorted(variables))
+
+    def _create_api(self, lang, variables):
+        kwargs = {'lang': lang}
+        if self.tessdata_path:
+            kwargs['path'] = self.tessdata_path
+        api = tesserocr.PyTessBaseAPI(**kwargs)
+        for name, value in variables:
+            api.SetVariable(name, value)
+        return api
+
+    def _worker(self, ready, errors):
+        # 每种（语言, 变量）组合对应一个已初始化的 API，避免重复加载模型
+        apis = {}
+        try:
+            apis[(self.lang, ())] = self._create_api(self.lang, ())
+        except Exception as e:
+            errors.append(e)
+            ready.set()
+            return
+        ready.set()
+
+        while True:
+            task = self._tasks.get()
+            if task is None:
+                break
+            future, image, lang, config = task
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                psm, variables = self._parse_config(config)
+                key = (lang or self.lang, variables)
+                if key not in apis:
+                    apis[key] = self._create_api(*key)
+                api = apis[key]
+                api.SetPageSegMode(tesserocr.PSM.AUTO if psm is None else psm)
+                future.set_result(self._recognize(api, image))
+            except Exception as e:
+                future.set_exception(e)
+
+        for api in apis.values():
+            api.End()
+
+    @staticmethod
+    def _recognize(api, image):
+        api.SetImage(image)
+        api.Recognize()
+        data = {'text': [], 'left': [], 'top': [], 'width': [], 'height': [], 'conf': []}
+        level = tesserocr.RIL.WORD
+        iterator = api.GetIterator()
+        if iterator is not None:
+            for word in tesserocr.iterate_level(iterator, level):
+                text = word.GetUTF8Text(level)
+                box = word.BoundingBox(level)
+                if text is None or box is None:
+                    continue
+                x1, y1, x2, y2 = box
+                data['text'].append(text)
+                data['left'].append(x1)
+                data['top'].append(y1)
+                data['width'].append(x2 - x1)
+                data['height'].append(y2 - y1)
+                data['conf'].append(word.Confidence(level))
+        api.Clear()
+        return data
+
+    def submit(self, image, lang=None, config=''):
+        """
+        提交 OCR 任务。队列已满且在 submit_timeout 内没有空位时抛出 RuntimeError。
+        :return: concurrent.futures.Future
+        """
+        future = Future()
+        try:
+            self._tasks.put((future, image, lang, config), timeout=self.submit_timeout)
+        except queue.Full:
+            raise RuntimeError("OCR 队列已满，请稍后重试")
+        return future
+
+    def image_to_data(self, image, lang=None, config=''):
+        """返回与 pytesseract.Output.DICT 相同结构的识别结果"""
+        return self.submit(image, lang, config).result()
+
+    def close(self):
+        """停止全部工作线程并释放已加载的模型"""
+        for thread in self._threads:
+            if thread.is_alive():
+                self._tasks.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+
+_ocr_backend = None
+_ocr_backend_lock = threading.Lock()
+
+
+def get_ocr_backend():
+    """
+    获取当前 OCR 后端，首次调用时按 OCR_BACKEND 创建。
+    常驻工作池创建失败时退回 pytesseract。
+    """
+    global _ocr_backend
+    with _ocr_backend_lock:
+        if _ocr_backend is None:
+            if OCR_BACKEND in ('auto', 'tesserocr') and tesserocr is not None:
+                try:
+                    _ocr_backend = TesserocrPoolBackend(workers=OCR_POOL_WORKERS)
+                except RuntimeError as e:
+                    print(f"[WARNING] {e}，改用 pytesseract")
+            if _ocr_backend is None:
+                _ocr_backend = PytesseractBackend(max_concurrency=OCR_POOL_WORKERS)
+        return _ocr_backend
+
+
+def set_ocr_backend(backend):
+    """
+    替换当前 OCR 后端，并关闭原有后端。
+    :param backend: 提供 image_to_data / close 方法的后端对象，None 表示下次使用时按 OCR_BACKEND 重新创建
+    """
+    global _ocr_backend
+    with _ocr_backend_lock:
+        previous, _ocr_backend = _ocr_backend, backend
+    if previous is not None and previous is not backend:
+        previous.close()
+
+
+def _run_ocr(image, lang=None, config=''):
+    """对图片执行 OCR，返回文字及位置信息列表"""
+    ocr_data = get_ocr_backend().image_to_data(image, lang=lang, config=config)
 
     text_boxes = []
     for i in range(len(ocr_data['text'])):
@@ -60,6 +703,312 @@ def extract_text_and_boxes(image_path):
     return text_boxes
 
 
+def resolve_preprocess_options(preprocess):
+    """
+    解析预处理参数。
+    :param preprocess: None/False 表示不预处理，True 使用默认参数，字典则覆盖部分默认参数
+    :return: 完整的参数字典或 None
+    """
+    if not preprocess:
+        return None
+    options = dict(OCR_PREPROCESS_DEFAULTS)
+    if isinstance(preprocess, dict):
+        unknown = set(preprocess) - set(options)
+        if unknown:
+            raise ValueError(f"未知的预处理参数：{', '.join(sorted(unknown))}")
+        options.update(preprocess)
+    return options
+
+
+def _otsu_threshold(gray):
+    """计算灰度数组的 Otsu 阈值"""
+    hist = np.bincount(gray.ravel(), minlength=256).astype(np.float64)
+    levels = np.arange(256, dtype=np.float64)
+    weight_dark = np.cumsum(hist)
+    weight_light = weight_dark[-1] - weight_dark
+    sum_dark = np.cumsum(levels * hist)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_dark = sum_dark / weight_dark
+        mean_light = (sum_dark[-1] - sum_dark) / weight_light
+        between = weight_dark * weight_light * (mean_dark - mean_light) ** 2
+    return int(np.nanargmax(between)) if np.isfinite(between).any() else 127
+
+
+def _estimate_text_height(ink):
+    """
+    根据水平投影估计文字行高：统计连续含有墨迹的行，取其长度的中位数。
+    :param ink: (H, W) 的布尔数组，True 表示文字像素
+    :return: 估计的行高（像素），无法估计时返回 None
+    """
+    height, width = ink.shape
+    rows = ink.sum(axis=1) > max(1, width // 500)
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], rows.astype(np.int8), [0]))))
+    runs = edges[1::2] - edges[::2]
+    runs = runs[(runs >= 3) & (runs <= max(3, height // 4))]
+    return float(np.median(runs)) if len(runs) else None
+
+
+def _rotate_points(xs, ys, angle, center, new_center):
+    """按 PIL Image.rotate 的约定（逆时针，单位为度）旋转坐标"""
+    theta = math.radians(angle)
+    cos_t, sin_t = math.cos(theta), math.sin(theta)
+    dx, dy = xs - center[0], ys - center[1]
+    return (new_center[0] + dx * cos_t + dy * sin_t,
+            new_center[1] - dx * sin_t + dy * cos_t)
+
+
+def _estimate_skew(ink, max_angle, step, sample_size=50000):
+    """
+    投影轮廓法估计倾斜角：旋转墨迹点坐标，使水平投影最“尖锐”的角度即为校正角度。
+    :return: 供 Image.rotate 使用的校正角度（度）
+    """
+    ys, xs = np.nonzero(ink)
+    if len(xs) < 10:
+        return 0.0
+    if len(xs) > sample_size:
+        pick = np.random.default_rng(0).choice(len(xs), sample_size, replace=False)
+        xs, ys = xs[pick], ys[pick]
+    xs, ys = xs.astype(np.float64), ys.astype(np.float64)
+
+    best_angle, best_score = 0.0, -1.0
+    for angle in np.arange(-max_angle, max_angle + step / 2, step):
+        _, rotated_y = _rotate_points(xs, ys, angle, (0.0, 0.0), (0.0, 0.0))
+        hist = np.bincount((rotated_y - rotated_y.min()).astype(np.int64))
+        score = float((hist.astype(np.float64) ** 2).sum())
+        if score > best_score:
+            best_angle, best_score = float(angle), score
+    return best_angle
+
+
+def preprocess_for_ocr(image, options):
+    """
+    OCR 前的自适应预处理：灰度化，可选倾斜校正，按估计的文字行高缩放到目标高度，
+    可选二值化。
+    :param image: PIL 图片对象
+    :param options: resolve_preprocess_options 返回的参数字典
+    :return: (处理后的图片, 坐标变换信息)，变换信息用于 map_box_to_original
+    """
+    gray_image = image.convert("L")
+    gray = np.asarray(gray_image)
+
+    # 阈值与文字像素（浅色文字深色背景时取反）
+    threshold = _otsu_threshold(gray)
+    ink = gray <= threshold
+    inverted = ink.mean() > 0.5
+    if inverted:
+        ink = ~ink
+    background = 0 if inverted else 255
+
+    def to_ink(values):
+        return (values > threshold) if inverted else (values <= threshold)
+
+    # 先校正倾斜，否则倾斜的文字行会在水平投影中粘连，影响行高估计
+    angle = 0.0
+    if options['deskew']:
+        angle = _estimate_skew(ink, options['max_skew_angle'], options['skew_step'])
+        if angle:
+            gray_image = gray_image.rotate(angle, resample=Image.BILINEAR, expand=True, fillcolor=background)
+            gray = np.asarray(gray_image)
+            ink = to_ink(gray)
+    rotated_size = gray_image.size
+
+    # 缩放到目标行高，并限制总像素数
+    width, height = rotated_size
+    text_height = _estimate_text_height(ink)
+    scale = options['target_text_height'] / text_height if text_height else 1.0
+    scale = min(max(scale, options['min_scale']), options['max_scale'])
+    scale = min(scale, math.sqrt(options['max_pixels'] / float(width * height)))
+    if abs(scale - 1.0) < 0.1:
+        scale = 1.0
+
+    if scale != 1.0:
+        gray_image = gray_image.resize((max(1, round(width * scale)), max(1, round(height * scale))),
+                                       Image.BICUBIC if scale > 1 else Image.BOX)
+        ink = to_ink(np.asarray(gray_image))
+
+    if options['binarize']:
+        processed = Image.fromarray(np.where(ink, 0, 255).astype(np.uint8), "L")
+    else:
+        processed = gray_image
+
+    transform = {
+        'scale': scale,
+        'angle': angle,
+        'rotated_size': rotated_size,
+        'original_size': image.size,
+    }
+    print(f"[DEBUG] OCR 预处理：倾斜校正 {angle:.1f}°，行高 {text_height}，缩放 {scale:.2f}")
+    return processed, transform
+
+
+def map_box_to_original(position, transform):
+    """
+    将预处理后图片中的文字框映射回原图坐标。
+    :param position: 预处理后图片中的文字框 (x, y, w, h)
+    :param transform: preprocess_for_ocr 返回的坐标变换信息
+    :return: 原图中的文字框 (x, y, w, h)
+    """
+    x, y, w, h = position
+    scale = transform['scale']
+    xs = np.array([x, x + w, x, x + w], dtype=np.float64) / scale
+    ys = np.array([y, y, y + h, y + h], dtype=np.float64) / scale
+
+    original_w, original_h = transform['original_size']
+    if transform['angle']:
+        rotated_w, rotated_h = transform['rotated_size']
+        xs, ys = _rotate_points(xs, ys, -transform['angle'],
+                                (rotated_w / 2.0, rotated_h / 2.0), (original_w / 2.0, original_h / 2.0))
+
+    left = int(max(0, math.floor(xs.min())))
+    top = int(max(0, math.floor(ys.min())))
+    right = int(min(original_w, math.ceil(xs.max())))
+    bottom = int(min(original_h, math.ceil(ys.max())))
+    return left, top, max(0, right - left), max(0, bottom - top)
+
+
+_preprocess_cache = OrderedDict()
+_preprocess_cache_lock = threading.Lock()
+
+
+def _cached_preprocess(image, options, cache_key=None):
+    """按图片摘要缓存预处理结果（只保存在内存中）"""
+    if cache_key is None:
+        return preprocess_for_ocr(image, options)
+
+    with _preprocess_cache_lock:
+        if cache_key in _preprocess_cache:
+            _preprocess_cache.move_to_end(cache_key)
+            return _preprocess_cache[cache_key]
+
+    result = preprocess_for_ocr(image, options)
+    with _preprocess_cache_lock:
+        _preprocess_cache[cache_key] = result
+        while len(_preprocess_cache) > OCR_PREPROCESS_CACHE_ENTRIES:
+            _preprocess_cache.popitem(last=False)
+    return result
+
+
+def clamp_region(region, size):
+    """
+    将选区裁剪到图片范围内。
+    :param region: 选区 (x, y, w, h)
+    :param size: 图片尺寸 (宽, 高)
+    :return: 裁剪后的选区 (x, y, w, h)
+    """
+    x, y, w, h = (int(v) for v in region)
+    left, top = max(0, x), max(0, y)
+    right, bottom = min(size[0], x + w), min(size[1], y + h)
+    if right <= left or bottom <= top:
+        raise ValueError(f"选区 {tuple(region)} 不在图片范围内")
+    return left, top, right - left, bottom - top
+
+
+def _ocr_region(image, lang=None, config='', region=None, preprocess=None, content_hash=None):
+    """
+    对整张图片或选区执行 OCR（可先预处理），并把文字框坐标映射回整张图片。
+    :param preprocess: resolve_preprocess_options 返回的参数字典或 None
+    :param content_hash: 图片内容摘要，用于缓存预处理结果
+    """
+    x, y = 0, 0
+    if region is not None:
+        x, y, w, h = region
+        image = image.crop((x, y, x + w, y + h))
+
+    if preprocess is None:
+        text_boxes = _run_ocr(image, lang, config)
+    else:
+        cache_key = None
+        if content_hash is not None:
+            cache_key = OCRCache.make_key(content_hash, {'region': region, 'preprocess': preprocess})
+        processed, transform = _cached_preprocess(image, preprocess, cache_key)
+        text_boxes = _run_ocr(processed, lang, config)
+        for box in text_boxes:
+            box['position'] = map_box_to_original(box['position'], transform)
+
+    for box in text_boxes:
+        bx, by, bw, bh = box['position']
+        box['position'] = (bx + x, by + y, bw, bh)
+    return text_boxes
+
+
+def extract_text_and_boxes(image_path, lang=None, config='', use_cache=True, region=None, preprocess=None,
+                           image=None, content_hash=None):
+    """
+    提取图片中的文字及其位置信息。相同内容、相同参数的图片直接读取缓存。
+    :param image_path: 图片路径
+    :param lang: Tesseract 语言（如 'eng'、'chi_sim'），None 表示默认
+    :param config: 额外的 Tesseract 参数
+    :param use_cache: 是否使用 OCR 结果缓存
+    :param region: 只识别该选区 (x, y, w, h)，返回的坐标仍基于整张图片；None 表示整张图片
+    :param preprocess: OCR 预处理参数，见 resolve_preprocess_options；坐标会映射回原图
+    :param image: 已解码的同一张图片，传入时不再重新读取文件
+    :param content_hash: 图片内容摘要，传入时不再读取文件计算（此时 image_path 可以为 None）
+    :return: OCR 提取的文字和位置信息（字典列表形式）
+    """
+    if image is None:
+        image = Image.open(image_path)
+    if region is not None:
+        region = clamp_region(region, image.size)
+    preprocess = resolve_preprocess_options(preprocess)
+
+    if not use_cache:
+        return _ocr_region(image, lang, config, region, preprocess)
+
+    if content_hash is None:
+        content_hash = file_content_hash(image_path)
+    params = {'lang': lang, 'config': config, 'backend': get_ocr_backend().name,
+              'region': region, 'preprocess': preprocess}
+    key = ocr_cache.make_key(content_hash, params)
+    cached = ocr_cache.get(key)
+    if cached is None:
+        cached = _ocr_region(image, lang, config, region, preprocess, content_hash)
+        ocr_cache.set(key, cached)
+    else:
+        print(f"[DEBUG] OCR 缓存命中：{image_path or content_hash}")
+
+    # 返回副本，避免调用方修改缓存内容
+    return [{'text': box['text'], 'position': tuple(box['position'])} for box in cached]
+
+
+def _crop_pixels(image, position):
+    """
+    裁剪文字区域，返回 (N, 3) 的 uint8 像素数组。
+    :param image: 原始图片对象
+    :param position: 文字区域 (x, y, w, h)
+    """
+    x, y, w, h = position
+    cropped_image = image.crop((x, y, x + w, y + h))  # 裁剪文字区域
+    if cropped_image.mode != "RGB":
+        cropped_image = cropped_image.convert("RGB")
+    return np.asarray(cropped_image).reshape(-1, 3)
+
+
+def _most_frequent_color(pixels):
+    """
+    基于量化直方图的众数颜色估计，时间复杂度与像素数成线性关系：
+    先按高位统计出现次数最多的量化桶，再在该桶内按低位统计精确颜色。
+    :param pixels: (N, 3) 的 uint8 数组，N > 0
+    :return: RGB 元组
+    """
+    bits = COLOR_QUANT_BITS
+    low_bits = 8 - bits
+    pixels = pixels.astype(np.int32)
+
+    high = pixels >> low_bits
+    bins = (high[:, 0] << (2 * bits)) | (high[:, 1] << bits) | high[:, 2]
+    best_bin = np.bincount(bins, minlength=1 << (3 * bits)).argmax()
+
+    members = pixels[bins == best_bin] & ((1 << low_bits) - 1)
+    codes = (members[:, 0] << (2 * low_bits)) | (members[:, 1] << low_bits) | members[:, 2]
+    best_low = int(np.bincount(codes, minlength=1 << (3 * low_bits)).argmax())
+
+    high_mask = (1 << bits) - 1
+    low_mask = (1 << low_bits) - 1
+    high_rgb = (best_bin >> (2 * bits), (best_bin >> bits) & high_mask, best_bin & high_mask)
+    low_rgb = (best_low >> (2 * low_bits), (best_low >> low_bits) & low_mask, best_low & low_mask)
+    return tuple(int((h << low_bits) | l) for h, l in zip(high_rgb, low_rgb))
+
+
 def get_dominant_background_color(image, position):
     """
     获取文字区域的主背景色。
@@ -67,56 +1016,187 @@ def get_dominant_background_color(image, position):
     :param position: 文字区域 (x, y, w, h)
     :return: 主色的 RGB 值
     """
-    x, y, w, h = position
-    cropped_image = image.crop((x, y, x + w, y + h))  # 裁剪文字区域
-    colors = cropped_image.getcolors(cropped_image.size[0] * cropped_image.size[1])
-    dominant_color = max(colors, key=lambda item: item[0])[1]  # 返回出现次数最多的颜色
-    return dominant_color[:3]  # 只返回 RGB
+    pixels = _crop_pixels(image, position)
+    if not len(pixels):
+        return (255, 255, 255)
+    return _most_frequent_color(pixels)  # 返回出现次数最多的颜色
 
 
 def get_text_color(image, position, background_color):
     """
-    提取文字颜色，使用增强的边缘检测和区域扩展。
+    提取文字颜色：排除与背景色接近的像素，取其余像素中出现次数最多的颜色。
     :param image: 原始图片对象
     :param position: 文字区域 (x, y, w, h)
     :param background_color: 背景色
     :return: 文字颜色的 RGB 值
     """
-    x, y, w, h = position
-    cropped_image = image.crop((x, y, x + w, y + h))
-
-    # 边缘检测并扩展区域
-    edges = cropped_image.convert("L").filter(ImageFilter.FIND_EDGES)
-    expanded_edges = ImageOps.expand(edges, border=2, fill=255)  # 扩展边缘区域
+    pixels = _crop_pixels(image, position)
 
-    colors = cropped_image.getcolors(cropped_image.size[0] * cropped_image.size[1])
+    # 排除与背景色接近的部分（RGB 各通道差值之和不超过阈值），提取对比度高的颜色
+    distance = np.abs(pixels.astype(np.int16) - np.array(background_color[:3], dtype=np.int16)).sum(axis=1)
+    text_pixels = pixels[distance > TEXT_COLOR_DISTANCE]
 
-    # 排除与背景色接近的部分，提取对比度高的颜色
-    text_colors = [color[:3] for count, color in colors if sum(abs(c - b) for c, b in zip(color[:3], background_color)) > 80]
-
-    if text_colors:
+    if len(text_pixels):
         # 返回出现频率最高的颜色
-        return max(text_colors, key=lambda c: text_colors.count(c))
+        return _most_frequent_color(text_pixels)
 
     # 如果无法精确提取，默认返回黑色
     return (0, 0, 0)
 
 
+@lru_cache(maxsize=FONT_CACHE_SIZE)
+def load_font(font_path, font_size):
+    """
+    加载字体对象，按 (字体路径, 字号) 缓存，避免重复读取和解析字体文件。
+    :param font_path: 字体路径
+    :param font_size: 字号
+    :return: 字体对象
+    """
+    return ImageFont.truetype(font_path, font_size)
+
+
+@lru_cache(maxsize=TEXT_MEASURE_CACHE_SIZE)
+def measure_text(font_path, font_size, text):
+    """
+    测量文字在指定字体和字号下的尺寸（结果会被缓存）。
+    :return: (宽, 高)
+    """
+    font = load_font(font_path, font_size)
+    if hasattr(font, 'getsize'):  # Pillow < 10
+        return font.getsize(text)
+    left, top, right, bottom = font.getbbox(text)
+    return right, bottom
+
+
 def calculate_font_size(position, text, font_path="arial.ttf"):
     """
     动态计算字体大小，使替换文字适配原文字区域。
+    返回第一个宽或高不再小于文字区域的字号（与逐号递增的结果一致），
+    通过倍增确定上界后二分查找，只需 O(log n) 次测量。
     :param position: 文字区域 (x, y, w, h)
     :param text: 替换的文字
     :param font_path: 字体路径
     :return: 动态适配的字体对象
     """
     x, y, w, h = position
-    font_size = 1  # 初始字体大小
-    font = ImageFont.truetype(font_path, font_size)
-    while font.getsize(text)[0] < w and font.getsize(text)[1] < h:
-        font_size += 1
-        font = ImageFont.truetype(font_path, font_size)
-    return font
+
+    def fits(size):
+        text_width, text_height = measure_text(font_path, size, text)
+        return text_width < w and text_height < h
+
+    if not fits(1):
+        return load_font(font_path, 1)
+
+    # 倍增找到第一个放不下的上界
+    low, high = 1, 2
+    while high < MAX_FONT_SIZE and fits(high):
+        low, high = high, high * 2
+    high = min(high, MAX_FONT_SIZE)
+
+    # 二分查找：low 总能放下，high 放不下（或已到上限）
+    while high - low > 1:
+        mid = (low + high) // 2
+        if fits(mid):
+            low = mid
+        else:
+            high = mid
+
+    # 字体微调（hinting）会让尺寸随字号出现 1px 左右的抖动，向下复查几个字号
+    size = high - 1
+    while size >= max(1, high - FONT_SIZE_JITTER):
+        if not fits(size):
+            high = size
+        size -= 1
+    return load_font(font_path, high)
+
+
+def normalize_replacements(replacements):
+    """
+    将文字替换规则统一为 (原文字, 替换文字) 列表，并忽略原文字为空的规则。
+    :param replacements: {原文字: 替换文字} 字典，或 (原文字, 替换文字) / 字典
+                         {'original': ..., 'replacement': ...} 组成的有序列表
+    :return: (原文字, 替换文字) 列表
+    """
+    if isinstance(replacements, dict):
+        items = replacements.items()
+    else:
+        items = [(item['original'], item['replacement']) if isinstance(item, dict) else tuple(item)
+                 for item in replacements]
+
+    edits = []
+    for original, replacement in items:
+        original = (original or '').strip()
+        if original:
+            edits.append((original, replacement or ''))
+    return edits
+
+
+def apply_text_replacements(image, replacements, text_boxes):
+    """
+    在图片对象上应用文字替换（原地绘制）。
+    每个文字框只应用第一条匹配的规则；颜色均从修改前的图片中采样。
+    :param image: PIL 图片对象
+    :param replacements: 替换规则，格式见 normalize_replacements
+    :param text_boxes: extract_text_and_boxes 的识别结果
+    :return: (替换处数, 未找到的原文字列表)
+    """
+    edits = normalize_replacements(replacements)
+
+    # 先在原图上确定每个文字框的替换内容和颜色，再统一绘制
+    plan = []
+    found = set()
+    for box in text_boxes:
+        for original, replacement in edits:
+            if box['text'] == original:
+                position = box['position']
+                background_color = get_dominant_background_color(image, position)
+                text_color = get_text_color(image, position, background_color)
+                print(f"[DEBUG] 正在替换文字：'{original}' -> '{replacement}'，位置：{position}，"
+                      f"背景色：{background_color}，文字颜色：{text_color}")
+                plan.append((position, replacement, background_color, text_color))
+                found.add(original)
+                break
+
+    draw = ImageDraw.Draw(image)
+    for (x, y, w, h), replacement, background_color, text_color in plan:
+        # 用动态背景色覆盖原文字
+        draw.rectangle([x, y, x + w, y + h], fill=background_color)
+
+        # 在覆盖区域绘制替换文字（动态调整字体大小）
+        if replacement:
+            font = calculate_font_size((x, y, w, h), replacement)
+            draw.text((x, y), replacement, fill=text_color, font=font)
+
+    missing = [original for original, _ in edits if original not in found]
+    for original in missing:
+        print(f"[WARNING] 未找到要替换的文字：'{original}'")
+    return len(plan), missing
+
+
+def replace_texts_in_image(image_path, replacements, output_path, lang=None, config='', region=None,
+                           preprocess=None):
+    """
+    批量替换图片中的文字：只执行一次 OCR，一次绘制全部修改，最后只保存一次。
+    :param image_path: 原图片路径
+    :param replacements: 替换规则，格式见 normalize_replacements
+    :param output_path: 输出图片路径
+    :param lang: Tesseract 语言
+    :param config: 额外的 Tesseract 参数
+    :param region: 只在该选区 (x, y, w, h) 内识别和替换；None 表示整张图片
+    :param preprocess: OCR 预处理参数，见 resolve_preprocess_options
+    :return: 未找到的原文字列表
+    """
+    image = Image.open(image_path)
+
+    # 提取文字及其位置信息
+    text_boxes = extract_text_and_boxes(image_path, lang, config, region=region, preprocess=preprocess,
+                                        image=image)
+    count, missing = apply_text_replacements(image, replacements, text_boxes)
+
+    # 保存修改后的图片
+    image.save(output_path)
+    print(f"[DEBUG] 图片已保存到：{output_path}，共替换 {count} 处")
+    return missing
 
 
 def replace_text_in_image(image_path, original_text, replacement_text, output_path):
@@ -128,37 +1208,177 @@ def replace_text_in_image(image_path, original_text, replacement_text, output_pa
     :param output_path: 输出图片路径
     """
     print(f"[DEBUG] 开始替换文字：'{original_text}' -> '{replacement_text}'")
+    replace_texts_in_image(image_path, [(original_text, replacement_text)], output_path)
+
+
+def save_image(image, output_path):
+    """
+    保存图片；输出为 JPEG 时去掉透明通道。
+    :param image: PIL 图片对象
+    :param output_path: 输出图片路径
+    """
+    if image.mode in ("RGBA", "P") and os.path.splitext(output_path)[1].lower() in ('.jpg', '.jpeg'):
+        image = image.convert("RGB")
+    image.save(output_path)
+    print(f"[DEBUG] 图片已保存到：{output_path}")
+
+
+def edit_image_object(image, replacements=None, color_pairs=None, lang=None, config='', region=None,
+                      preprocess=None, intermediate_path=None, keep_palette=True, tiled=None,
+                      memory_budget=DEFAULT_MEMORY_BUDGET, pixel_threshold=TILED_PIXEL_THRESHOLD,
+                      image_path=None, content_hash=None):
+    """
+    在已解码的图片上依次完成文字替换和颜色替换（图片可能被原地修改）。
+    参数含义见 edit_image；image_path 或 content_hash 至少提供一个，用于 OCR 缓存。
+    :return: (结果图片, 未找到的原文字列表)
+    """
+    missing = []
+    if replacements:
+        text_boxes = extract_text_and_boxes(image_path, lang, config, region=region, preprocess=preprocess,
+                                            image=image, content_hash=content_hash)
+        count, missing = apply_text_replacements(image, replacements, text_boxes)
+        print(f"[DEBUG] 文字替换完成，共替换 {count} 处")
+        if intermediate_path:
+            save_image(image, intermediate_path)
+
+    if color_pairs:
+        image = apply_color_pairs(image, color_pairs, keep_palette, tiled, memory_budget, pixel_threshold)
+    return image, missing
+
+
+def edit_image(image_path, output_path, replacements=None, color_pairs=None, lang=None, config='',
+               region=None, preprocess=None, intermediate_path=None, keep_palette=True, tiled=None,
+               memory_budget=DEFAULT_MEMORY_BUDGET, pixel_threshold=TILED_PIXEL_THRESHOLD):
+    """
+    编辑流水线：只解码一次图片，依次在内存中完成文字替换和颜色替换，最后只编码一次。
+    :param image_path: 原图片路径
+    :param output_path: 输出图片路径
+    :param replacements: 文字替换规则，格式见 normalize_replacements；None 表示不修改文字
+    :param color_pairs: 颜色替换规则，格式见 normalize_color_pairs；None 表示不修改颜色
+    :param lang: Tesseract 语言
+    :param config: 额外的 Tesseract 参数
+    :param region: 只在该选区 (x, y, w, h) 内识别和替换文字
+    :param preprocess: OCR 预处理参数，见 resolve_preprocess_options
+    :param intermediate_path: 指定时额外保存文字替换后的中间结果
+    :param keep_palette: 调色板图片只改写调色板并保持索引格式
+    :param tiled: 颜色替换是否分块处理；None 表示按 pixel_threshold 自动选择
+    :param memory_budget: 分块模式的内存预算（字节）
+    :param pixel_threshold: 自动启用分块模式的像素数阈值
+    :return: 未找到的原文字列表
+    """
     image = Image.open(image_path)
-    draw = ImageDraw.Draw(image)
+    image.load()
 
-    # 提取文字及其位置信息
-    text_boxes = extract_text_and_boxes(image_path)
+    image, missing = edit_image_object(image, replacements, color_pairs, lang, config, region, preprocess,
+                                       intermediate_path, keep_palette, tiled, memory_budget, pixel_threshold,
+                                       image_path=image_path)
+    save_image(image, output_path)
+    return missing
 
-    replaced = False  # 标记是否成功替换文字
-    for box in text_boxes:
-        if box['text'] == original_text:
-            x, y, w, h = box['position']
-            print(f"[DEBUG] 正在替换文字：'{original_text}'，位置：{x}, {y}, {w}, {h}")
 
-            # 获取文字区域的背景色和文字颜色
-            background_color = get_dominant_background_color(image, (x, y, w, h))
-            text_color = get_text_color(image, (x, y, w, h), background_color)
+class EditResultCache:
+    """
+    编辑结果缓存：以原图内容摘要和编辑参数的规范化编码为键，
+    结果文件（编辑后的图片，或编辑历史中一个步骤的差异）按内容寻址保存在磁盘上，
+    并按总大小淘汰最久未使用的条目。
+    """
 
-            print(f"[DEBUG] 检测到背景色：{background_color}，文字颜色：{text_color}")
+    def __init__(self, cache_dir=EDIT_CACHE_DIR, max_bytes=EDIT_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
 
-            # 动态调整字体大小
-            font = calculate_font_size((x, y, w, h), replacement_text)
+    def filename(self, key, ext):
+        """缓存结果的文件名"""
+        return f"{key}{ext.lower()}"
 
-            # 用动态背景色覆盖原文字
-            draw.rectangle([x, y, x + w, y + h], fill=background_color)
+    def path(self, key, ext):
+        return os.path.join(self.cache_dir, self.filename(key, ext))
 
-            # 在覆盖区域绘制替换文字
-            draw.text((x, y), replacement_text, fill=text_color, font=font)
-            replaced = True
+    def get(self, key, ext):
+        """
+        读取缓存的结果。
+        :return: (结果路径, 未找到的原文字列表)，未命中时返回 None
+        """
+        path = self.path(key, ext)
+        if not os.path.isfile(path):
+            return None
+        os.utime(path)  # 刷新最近使用时间
 
-    if not replaced:
-        print(f"[WARNING] 未找到要替换的文字：'{original_text}'")
+        missing = []
+        try:
+            with open(os.path.join(self.cache_dir, f"{key}.json"), 'r', encoding='utf-8') as f:
+                missing = json.load(f).get('missing', [])
+        except (OSError, ValueError):
+            pass
+        return path, missing
 
-    # 保存修改后的图片
-    image.save(output_path)
-    print(f"[DEBUG] 图片已保存到：{output_path}")
\ No newline at end of file
+    def put(self, key, ext, produce):
+        """
+        生成并写入缓存结果。
+        :param produce: 回调 produce(临时输出路径)，返回未找到的原文字列表
+        :return: (结果路径, 未找到的原文字列表)
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self.path(key, ext)
+        tmp_path = os.path.join(self.cache_dir, f"{key}.{threading.get_ident()}.tmp{ext.lower()}")
+        try:
+            missing = produce(tmp_path)
+            with open(os.path.join(self.cache_dir, f"{key}.json"), 'w', encoding='utf-8') as f:
+                json.dump({'missing': missing}, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        evict_directory(self.cache_dir, self.max_bytes)
+        return path, missing
+
+
+edit_result_cache = EditResultCache()
+
+
+def edit_cache_key(content_hash, replacements=None, color_pairs=None, lang=None, config='', region=None,
+                   preprocess=None, keep_palette=True, tiled=None, pixel_threshold=TILED_PIXEL_THRESHOLD):
+    """
+    由原图内容摘要和编辑参数生成结果缓存键；等价的参数写法得到相同的键。
+    """
+    rules = normalize_color_pairs(color_pairs or [])
+    params = {
+        'replacements': [list(edit) for edit in normalize_replacements(replacements or [])],
+        'colors': [{'source': list(rule['source']), 'target': list(rule['target']),
+                    'tolerance': list(rule['tolerance']) if isinstance(rule['tolerance'], (tuple, list))
+                    else rule['tolerance'],
+                    'mode': rule['mode']} for rule in rules],
+        'lang': lang,
+        'config': config,
+        'region': list(region) if region else None,
+        'preprocess': resolve_preprocess_options(preprocess),
+        'keep_palette': keep_palette,
+        'tiled': tiled,
+        'pixel_threshold': pixel_threshold,
+    }
+    return OCRCache.make_key(content_hash, params)
+
+
+def cached_edit_image(image_path, output_ext=None, cache=None, **edit_options):
+    """
+    带结果缓存的 edit_image：相同图片、相同编辑参数的请求直接返回已有结果。
+    :param image_path: 原图片路径
+    :param output_ext: 结果扩展名，默认与原图相同
+    :param cache: EditResultCache 对象，默认使用全局缓存
+    :param edit_options: 传给 edit_image 的其余参数
+    :return: (结果路径, 未找到的原文字列表, 是否命中缓存)
+    """
+    cache = cache or edit_result_cache
+    output_ext = (output_ext or os.path.splitext(image_path)[1] or '.png').lower()
+    key_options = {name: value for name, value in edit_options.items()
+                   if name not in ('intermediate_path', 'memory_budget')}
+    key = edit_cache_key(file_content_hash(image_path), **key_options)
+
+    cached = cache.get(key, output_ext)
+    if cached is not None:
+        print(f"[DEBUG] 编辑结果缓存命中：{cached[0]}")
+        return cached[0], cached[1], True
+
+    path, missing = cache.put(key, output_ext,
+                              lambda tmp_path: edit_image(image_path, tmp_path, **edit_options))
+    return path, missing, False
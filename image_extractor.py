@@ -1,59 +1,144 @@
+import json
 import os
-from flask import Flask, render_template, request
+import threading
+import uuid
+from flask import Flask, Response, render_template, request, url_for
 from werkzeug.utils import secure_filename
-from pdf_image_extract import process_pdf_with_regex
-from ppt_image_extract import extract_images_from_pptx
+from pdf_image_extract import iter_pdf_with_regex
+from ppt_image_extract import iter_images_from_pptx
+from page_range import PageRangeSet
+from extract_cache import (EXTRACT_CACHE_MAX_BYTES, ExtractionCache, extract_cache_key, file_sha256,
+                           read_results, save_stream_with_hash)
+from extract_jobs import DONE, FAILED, JOB_WORKERS, JOBS_DB, ExtractionJobQueue
 
 app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['EXTRACTED_FOLDER'] = 'static/extracted_images'  # 图片保存路径
+# PDF 并行提取的进程数（None 表示 CPU 核数，1 表示不并行）
+app.config['EXTRACT_WORKERS'] = None
+# PDF 矢量图（图表等）区域的渲染 DPI，None 表示只提取位图
+app.config['RENDER_VECTOR_DPI'] = None
+# PPTX 是否使用 ZIP 快速模式（直接读取 ppt/media，不加载 python-pptx 对象模型）
+app.config['PPTX_FAST_EXTRACT'] = True
+# 提取图片目录（缓存条目）的总大小上限
+app.config['EXTRACT_CACHE_MAX_BYTES'] = EXTRACT_CACHE_MAX_BYTES
+# 后台提取任务的数据库路径与同时运行的任务数
+app.config['JOBS_DB'] = JOBS_DB
+app.config['JOB_WORKERS'] = JOB_WORKERS
+# 每个后台任务提取 PDF 的进程数，None 表示 CPU 核数平均分给 JOB_WORKERS 个任务
+app.config['JOB_EXTRACT_WORKERS'] = None
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs(app.config['EXTRACTED_FOLDER'], exist_ok=True)
 
 
 def parse_page_input(pages_input):
-    """解析页码范围输入，返回页码列表"""
+    """
+    解析页码范围输入，如 "1,3-5"。
+    :return: 页码（1-based）的 PageRangeSet，输入为空时返回 None
+    """
     if not pages_input:
         return None
 
-    pages = set()
-    for part in pages_input.split(','):
-        part = part.strip()
-        if '-' in part:
-            start, end = map(int, part.split('-'))
-            pages.update(range(start, end + 1))
+    return PageRangeSet.parse(pages_input)
+
+
+def save_upload(file):
+    """
+    保存上传的 PDF/PPTX 文件，接收时同时计算内容摘要，并以摘要作为上传目录名，
+    同名但内容不同的文件不会互相覆盖。
+    :return: (文件路径, 扩展名, 内容摘要)；文件无效时返回 None
+    """
+    if not file or not (file.filename.endswith('.pdf') or file.filename.endswith('.pptx')):
+        return None
+
+    file_ext = os.path.splitext(file.filename)[1].lower()
+    filename = secure_filename(file.filename)
+    if not filename.lower().endswith(file_ext):  # 文件名全部是非 ASCII 字符时
+        filename = f"document{file_ext}"
+
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    tmp_path = os.path.join(app.config['UPLOAD_FOLDER'], f"upload_{uuid.uuid4().hex}.tmp")
+    try:
+        doc_hash = save_stream_with_hash(file.stream, tmp_path)
+        upload_path = os.path.join(app.config['UPLOAD_FOLDER'], doc_hash)
+        os.makedirs(upload_path, exist_ok=True)
+        file_path = os.path.join(upload_path, filename)
+        os.replace(tmp_path, file_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return file_path, file_ext, doc_hash
+
+
+_extract_cache = None
+_extract_cache_lock = threading.Lock()
+
+
+def get_extract_cache():
+    """获取（首次调用时创建）提取结果缓存"""
+    global _extract_cache
+    with _extract_cache_lock:
+        if _extract_cache is None:
+            _extract_cache = ExtractionCache(app.config['EXTRACTED_FOLDER'], app.config['EXTRACT_CACHE_MAX_BYTES'])
+        return _extract_cache
+
+
+def iter_results(file_path, file_ext, pages_input, doc_hash=None, workers=None):
+    """
+    按文件类型逐张产出提取结果（生成器，图片保存后立即产出）。
+    相同内容、相同页码集合的文档直接返回缓存的结果。
+    :param pages_input: 页码范围输入，如 "1,3-5"
+    :param doc_hash: 文档内容摘要，None 时根据文件计算
+    :param workers: PDF 提取的进程数，None 表示使用 EXTRACT_WORKERS
+    """
+    target_pages = parse_page_input(pages_input)  # PDF 与 PPTX 使用相同的解析逻辑
+    cache = get_extract_cache()
+    vector_dpi = app.config['RENDER_VECTOR_DPI'] if file_ext == '.pdf' else None
+    key = extract_cache_key(doc_hash or file_sha256(file_path), target_pages, {'vector_dpi': vector_dpi})
+    # 同一条目正在被其他请求（如后台任务）提取时，等待其完成后直接读取缓存
+    cached = cache.claim(key)
+    if cached is not None:
+        print(f"[DEBUG] 提取结果缓存命中：{key}")
+        yield from read_results(cached)
+        return
+
+    output_dir = cache.entry_dir(key)
+    extracted = None
+    count = 0
+    try:
+        if file_ext == '.pdf':
+            extracted = iter_pdf_with_regex(file_path, output_dir, target_pages,
+                                            workers=workers or app.config['EXTRACT_WORKERS'], vector_dpi=vector_dpi)
         else:
-            pages.add(int(part))
+            extracted = iter_images_from_pptx(file_path, output_dir, target_pages,
+                                              fast=app.config['PPTX_FAST_EXTRACT'])
 
-    return sorted(pages)
+        # 结果逐条写入条目的结果文件，不在内存中累积
+        with cache.writer(key) as results_file:
+            for result in extracted:
+                results_file.write(json.dumps(result, ensure_ascii=False) + "\n")
+                count += 1
+                yield result
+    except BaseException:
+        # 提取失败或客户端断开（GeneratorExit）时先停止提取（取消尚未开始的页块并等待进程结束），
+        # 再删除已写入的目录
+        if extracted is not None:
+            extracted.close()
+        cache.discard(key)
+        raise
+    cache.put(key, count)
 
 
 @app.route('/', methods=['GET', 'POST'])
 def index():
     if request.method == 'POST':
-        file = request.files.get('file')
         pages_input = request.form.get('pages', '').strip()
-
-        if not file or not (file.filename.endswith('.pdf') or file.filename.endswith('.pptx')):
+        upload = save_upload(request.files.get('file'))
+        if upload is None:
             return render_template('image_extract_index.html', error="Please upload a valid PDF or PPTX file.")
 
-        file_ext = os.path.splitext(file.filename)[1].lower()
-        unique_id = os.path.splitext(file.filename)[0]
-        upload_path = os.path.join(app.config['UPLOAD_FOLDER'], unique_id)
-        os.makedirs(upload_path, exist_ok=True)
-        file_path = os.path.join(upload_path, secure_filename(file.filename))
-        file.save(file_path)
-
-        output_dir = app.config['EXTRACTED_FOLDER']
-        results = []
-
         try:
-            if file_ext == '.pdf':
-                target_pages = parse_page_input(pages_input)
-                results = process_pdf_with_regex(file_path, output_dir, target_pages)
-            elif file_ext == '.pptx':
-                target_slides = parse_page_input(pages_input)  # 使用与 PDF 相同的解析逻辑
-                results = extract_images_from_pptx(file_path, output_dir, target_slides)
+            results = list(iter_results(upload[0], upload[1], pages_input, upload[2]))
         except Exception as e:
             return render_template('image_extract_index.html', error=str(e))
 
@@ -62,5 +147,156 @@ def index():
     return render_template('image_extract_index.html')
 
 
+def _format_event(event, payload, sse):
+    """把一条结果编码为 NDJSON 行或 SSE 事件"""
+    data = json.dumps(payload, ensure_ascii=False)
+    if sse:
+        return f"event: {event}\ndata: {data}\n\n"
+    return data + "\n"
+
+
+@app.route('/stream', methods=['POST'])
+def stream():
+    """
+    流式返回提取结果：每保存一张图片就输出一条记录，不在内存中累积结果。
+    默认输出 NDJSON（每行一个 JSON）；请求头 Accept 为 text/event-stream 或 format=sse 时输出 SSE。
+    最后一条记录为 {"done": true, "count": 图片数}，出错时输出 {"error": 错误信息}。
+    """
+    sse = (request.args.get('format') == 'sse'
+           or request.accept_mimetypes.best == 'text/event-stream')
+    pages_input = request.form.get('pages', '').strip()
+    upload = save_upload(request.files.get('file'))
+    if upload is None:
+        return {"error": "Please upload a valid PDF or PPTX file."}, 400
+
+    def generate():
+        count = 0
+        results = iter_results(upload[0], upload[1], pages_input, upload[2])
+        try:
+            for result in results:
+                count += 1
+                yield _format_event('result', result, sse)
+        except Exception as e:
+            print(f"[ERROR] 流式提取失败：{e}")
+            yield _format_event('error', {"error": str(e)}, sse)
+            return
+        finally:
+            # 客户端断开时立即关闭提取，未完成的缓存条目随之删除
+            results.close()
+        yield _format_event('done', {"done": True, "count": count}, sse)
+
+    mimetype = 'text/event-stream' if sse else 'application/x-ndjson'
+    # 禁止代理缓冲，保证结果能及时送达浏览器
+    return Response(generate(), mimetype=mimetype, headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+_job_queue = None
+_job_queue_lock = threading.Lock()
+
+
+def _job_extract_workers():
+    """每个后台任务可用的提取进程数，使所有任务合计不超过 CPU 核数"""
+    return app.config['JOB_EXTRACT_WORKERS'] or max(1, (os.cpu_count() or 1) // app.config['JOB_WORKERS'])
+
+
+def _run_job(file_path, file_ext, pages_input):
+    """后台任务的执行函数：使用受限的进程数提取"""
+    return iter_results(file_path, file_ext, pages_input, workers=_job_extract_workers())
+
+
+def get_job_queue():
+    """获取（首次调用时创建并启动）后台提取任务队列"""
+    global _job_queue
+    with _job_queue_lock:
+        if _job_queue is None:
+            _job_queue = ExtractionJobQueue(_run_job, app.config['JOBS_DB'], app.config['JOB_WORKERS']).start()
+        return _job_queue
+
+
+def _public_job(job):
+    """去掉任务中不应返回给客户端的字段（服务器上的文件路径）"""
+    job = dict(job)
+    job.pop('file_path', None)
+    return job
+
+
+def _job_payload(job):
+    """任务状态的 JSON 表示，附带相关链接"""
+    job = _public_job(job)
+    job['status_url'] = url_for('job_status', job_id=job['id'])
+    job['events_url'] = url_for('job_events', job_id=job['id'])
+    job['results_url'] = url_for('job_results', job_id=job['id'])
+    return job
+
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    """上传文件并提交后台提取任务，立即返回任务 ID"""
+    pages_input = request.form.get('pages', '').strip()
+    try:
+        parse_page_input(pages_input)  # 提前校验页码范围
+    except ValueError as e:
+        return {"error": f"Invalid page range: {e}"}, 400
+    upload = save_upload(request.files.get('file'))
+    if upload is None:
+        return {"error": "Please upload a valid PDF or PPTX file."}, 400
+
+    queue = get_job_queue()
+    job_id = queue.submit(upload[0], upload[1], pages_input)
+    return _job_payload(queue.get(job_id)), 202
+
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """查询任务状态与进度（已提取的图片数）"""
+    job = get_job_queue().get(job_id)
+    if job is None:
+        return {"error": "Job not found."}, 404
+    return _job_payload(job)
+
+
+@app.route('/jobs/<job_id>/events')
+def job_events(job_id):
+    """以 SSE 推送任务状态变化，任务结束后关闭连接"""
+    queue = get_job_queue()
+    if queue.get(job_id) is None:
+        return {"error": "Job not found."}, 404
+
+    def generate():
+        job = None
+        while True:
+            job = queue.wait(job_id, job)
+            if job is None:
+                return
+            yield _format_event('status', _public_job(job), sse=True)
+            if job['status'] in (DONE, FAILED):
+                return
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@app.route('/jobs/<job_id>/results')
+def job_results(job_id):
+    """获取已完成任务的结果；请求 HTML 时渲染结果页面"""
+    job = get_job_queue().get(job_id, with_results=True)
+    if job is None:
+        return {"error": "Job not found."}, 404
+    if job['status'] == FAILED:
+        return {"error": job['error'], "status": job['status']}, 500
+    if job['status'] != DONE:
+        return {"error": "Job is not finished yet.", "status": job['status'], "progress": job['progress']}, 409
+
+    if request.accept_mimetypes.best == 'text/html':
+        return render_template('image_extract_result.html', results=job['results'])
+    return {"id": job_id, "results": job['results']}
+
+
+# 应用启动时即启动任务队列，重启前未完成的任务无需等待请求就会继续执行
+# （调试模式下重载监视进程不启动，避免与实际服务进程重复处理任务）
+if __name__ != '__main__' or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+    get_job_queue()
+
+
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
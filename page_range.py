@@ -0,0 +1,100 @@
+from bisect import bisect_right
+
+
+class PageRangeSet:
+    """
+    紧凑的页码集合：以合并后的闭区间 [start, end] 保存页码，
+    成员判断为 O(log n)（n 为区间数），按页码顺序迭代。
+    """
+
+    __slots__ = ('_starts', '_ends')
+
+    def __init__(self, intervals=()):
+        """
+        :param intervals: (起始页, 结束页) 闭区间列表，可重叠、可乱序，起始页大于结束页的区间会被忽略
+        """
+        merged = []
+        for start, end in sorted(intervals):
+            if start > end:
+                continue
+            # 与上一个区间重叠或相邻时合并
+            if merged and start <= merged[-1][1] + 1:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        self._starts = [start for start, _ in merged]
+        self._ends = [end for _, end in merged]
+
+    @classmethod
+    def from_pages(cls, pages):
+        """
+        由页码集合构建。
+        :param pages: 可迭代的页码（list、set 等），已是 PageRangeSet 时直接返回
+        """
+        if isinstance(pages, cls):
+            return pages
+        return cls((page, page) for page in pages)
+
+    @classmethod
+    def parse(cls, spec):
+        """
+        解析页码范围字符串，例如 "1,3-5,10-1000000"，不会展开区间中的每个页码。
+        :param spec: 页码范围字符串，空白和空项会被忽略
+        :return: PageRangeSet
+        :raises ValueError: 存在无法解析的页码
+        """
+        intervals = []
+        for part in spec.split(','):
+            part = part.strip()
+            if not part:
+                continue
+            if '-' in part:
+                start, end = map(int, part.split('-'))
+            else:
+                start = end = int(part)
+            intervals.append((start, end))
+        return cls(intervals)
+
+    def intervals(self):
+        """返回合并后的闭区间列表"""
+        return list(zip(self._starts, self._ends))
+
+    def clamp(self, first, last):
+        """
+        截取到 [first, last] 范围内（例如文档的页码范围）。
+        :return: 新的 PageRangeSet
+        """
+        return PageRangeSet((max(start, first), min(end, last))
+                            for start, end in zip(self._starts, self._ends)
+                            if end >= first and start <= last)
+
+    def shift(self, offset):
+        """
+        整体平移页码，例如 shift(-1) 把 1-based 页码转换为 0-based 索引。
+        :return: 新的 PageRangeSet
+        """
+        return PageRangeSet((start + offset, end + offset) for start, end in zip(self._starts, self._ends))
+
+    def __contains__(self, page):
+        i = bisect_right(self._starts, page) - 1
+        return i >= 0 and page <= self._ends[i]
+
+    def __iter__(self):
+        for start, end in zip(self._starts, self._ends):
+            yield from range(start, end + 1)
+
+    def __len__(self):
+        return sum(end - start + 1 for start, end in zip(self._starts, self._ends))
+
+    def __bool__(self):
+        return bool(self._starts)
+
+    def __eq__(self, other):
+        if not isinstance(other, PageRangeSet):
+            return NotImplemented
+        return self._starts == other._starts and self._ends == other._ends
+
+    def __repr__(self):
+        parts = [str(start) if start == end else f"{start}-{end}"
+                 for start, end in zip(self._starts, self._ends)]
+        return f"PageRangeSet('{','.join(parts)}')"
@@ -1,124 +1,549 @@
+import hashlib
+import math
 import os
-import re
+from concurrent.futures import ProcessPoolExecutor
 import fitz  # PyMuPDF
 
-def extract_images(pdf_path, output_dir, target_pages=None):
-    """
-    从 PDF 中提取原始图片并保存到指定目录。
+from caption_match import CaptionIndex, find_figure_number, rect_distance
+from page_range import PageRangeSet
 
-    :param pdf_path: PDF 文件路径
-    :param output_dir: 图片保存目录
-    :param target_pages: 需要处理的页码列表，None 表示处理所有页码
-    :return: 包含图片路径（相对路径）和元信息的列表
-    """
-    # 获取 PDF 文件名（无扩展名）
+# 并行提取时，页数少于该值则直接在当前进程中处理
+PARALLEL_MIN_PAGES = 8
+# 每个工作进程分到的页块数量，用于平衡各进程的负载
+CHUNKS_PER_WORKER = 4
+# 矢量图渲染：默认 DPI、合并相邻绘图路径的间距（pt）、区域的最小边长（pt）与最少路径数
+FIGURE_RENDER_DPI = 150
+DRAWING_CLUSTER_GAP = 12
+MIN_FIGURE_SIZE = 36
+MIN_FIGURE_DRAWINGS = 3
+# 与图注的距离不超过该值（pt）时，认为绘图区域属于该图注
+CAPTION_MAX_DISTANCE = 72
+
+
+def _pdf_output_dir(pdf_path, output_dir):
+    """构建 PDF 图片的保存目录：output_dir/PDF 文件名（无扩展名）"""
     pdf_name = os.path.splitext(os.path.basename(pdf_path))[0]
-    # 构建保存目录
     pdf_output_dir = os.path.join(output_dir, pdf_name)
     os.makedirs(pdf_output_dir, exist_ok=True)
+    return pdf_output_dir
+
+
+def _new_dedupe_state(dedupe_content=False, owners=None):
+    """
+    创建图片去重状态。
+    :param dedupe_content: 是否按内容摘要合并不同 xref 的相同图片
+    :param owners: 并行模式下每个 xref 的首次出现位置 {xref: (页码索引, 图片序号)}
+    """
+    return {
+        'xrefs': {},                                # xref -> 已保存图片的相对路径
+        'contents': {} if dedupe_content else None,  # 内容摘要 -> 已保存图片的相对路径
+        'owners': owners,
+    }
+
+
+def _extract_page_images(doc, page_index, pdf_output_dir, dedupe=None):
+    """
+    提取单页中的原始图片并保存。同一 xref 的图片只解码、写入一次，
+    之后的出现位置直接指向已保存的文件。
+
+    :param doc: 已打开的 fitz 文档
+    :param page_index: 页码索引（0-based）
+    :param pdf_output_dir: 图片保存目录
+    :param dedupe: _new_dedupe_state 创建的去重状态，None 表示本页单独去重
+    :return: 该页的图片信息列表
+    """
+    dedupe = dedupe if dedupe is not None else _new_dedupe_state()
+    page = doc[page_index]
+    image_list = page.get_images(full=True)
+    if not image_list:
+        print(f"[DEBUG] 第 {page_index + 1} 页未找到图片。")
+        return []
 
-    doc = fitz.open(pdf_path)
     results = []
+    for img_index, img in enumerate(image_list):
+        xref = img[0]
+        result = {
+            "page": page_index + 1,
+            "image_index": img_index + 1,
+            "xref": xref,
+        }
 
-    for page_index in range(len(doc)):
-        page = doc[page_index]
-        if target_pages and (page_index + 1 not in target_pages):
+        # 已保存过的 xref，或（并行模式下）由其他页块负责保存的 xref
+        owner = dedupe['owners'].get(xref) if dedupe['owners'] is not None else None
+        if xref in dedupe['xrefs'] or (owner is not None and owner != (page_index, img_index)):
+            result["image_path"] = dedupe['xrefs'].get(xref)  # 并行模式下合并时再补全
+            results.append(result)
             continue
 
-        image_list = page.get_images(full=True)
-        if not image_list:
-            print(f"[DEBUG] 第 {page_index + 1} 页未找到图片。")
+        try:
+            # 提取图片
+            base_image = doc.extract_image(xref)
+            image_bytes = base_image["image"]
+            image_ext = base_image["ext"]  # 图片格式（如 png、jpeg）
+
+            # 内容相同的图片只保存一次
+            content_hash = None
+            if dedupe['contents'] is not None:
+                content_hash = hashlib.sha1(image_bytes).hexdigest()
+                result["content_hash"] = content_hash
+                if content_hash in dedupe['contents']:
+                    result["image_path"] = dedupe['xrefs'][xref] = dedupe['contents'][content_hash]
+                    results.append(result)
+                    continue
+
+            # 保存图片到文件
+            raw_filename = f"page_{page_index + 1}_img_{img_index + 1}.{image_ext}"
+            raw_output_path = os.path.join(pdf_output_dir, raw_filename)
+            with open(raw_output_path, "wb") as f:
+                f.write(image_bytes)
+
+            # 构建相对路径
+            relative_path = os.path.relpath(raw_output_path, "static")
+            dedupe['xrefs'][xref] = relative_path
+            if content_hash is not None:
+                dedupe['contents'][content_hash] = relative_path
+
+            # 保存图片信息
+            result["image_path"] = relative_path  # 返回相对路径
+            results.append(result)
+
+            print(f"[DEBUG] 原始图片已保存到 {raw_output_path}。")
+
+        except Exception as e:
+            print(f"[ERROR] 提取第 {page_index + 1} 页，第 {img_index + 1} 张图片失败：{e}")
+
+    return results
+
+
+def _link_shared_images(pages):
+    """
+    按页码顺序逐页合并结果：补全指向其他页块所保存图片的路径，
+    并把不同页块中内容相同的图片合并为同一个文件。
+    xref 的首次出现总在更早（或同一）页块中，因此可以边接收边处理。
+    :param pages: 可迭代的 (页码索引, 图片信息列表, 页面文本)，按页码顺序
+    :return: 生成器，逐页产出处理后的元组
+    """
+    xref_paths = {}
+    content_paths = {}
+    for page in pages:
+        page_results = page[1]
+        for result in page_results:
+            path = result.get("image_path")
+            if path is None:
+                # 负责保存的页提取失败时无法补全，保持为 None 并在下面丢弃
+                result["image_path"] = xref_paths.get(result["xref"])
+                continue
+            content_hash = result.get("content_hash")
+            if content_hash is not None:
+                kept = content_paths.setdefault(content_hash, path)
+                if kept != path:
+                    try:
+                        os.remove(os.path.join("static", path))
+                    except OSError:
+                        pass
+                    path = result["image_path"] = kept
+            if "xref" in result:
+                xref_paths.setdefault(result["xref"], path)
+
+        page_results[:] = [result for result in page_results if result["image_path"] is not None]
+        yield page
+
+
+def _target_page_indices(page_count, target_pages):
+    """返回需要处理的页码索引（0-based）列表，只遍历请求的页码，不逐页扫描整个文档"""
+    if not target_pages:
+        return list(range(page_count))
+    return [page - 1 for page in PageRangeSet.from_pages(target_pages).clamp(1, page_count)]
+
+
+def _split_chunks(page_indices, chunk_count):
+    """把页码索引切分为连续的页块"""
+    chunk_size = max(1, -(-len(page_indices) // chunk_count))
+    return [page_indices[i:i + chunk_size] for i in range(0, len(page_indices), chunk_size)]
+
+
+def _image_owners(doc, page_indices):
+    """记录每个 xref 首次出现的位置，并行模式下只由该位置所在的页块保存图片"""
+    owners = {}
+    for page_index in page_indices:
+        for img_index, img in enumerate(doc[page_index].get_images(full=True)):
+            owners.setdefault(img[0], (page_index, img_index))
+    return owners
+
+
+def _page_text_blocks(page):
+    """
+    读取页面中的文本块（不含图片数据）。
+    :return: [(矩形 (x0, y0, x1, y1), 文本)]
+    """
+    text_dict = page.get_text("dict", flags=fitz.TEXTFLAGS_DICT & ~fitz.TEXT_PRESERVE_IMAGES)
+    blocks = []
+    for block in text_dict["blocks"]:
+        if block.get("type") != 0:
             continue
+        text = "\n".join("".join(span["text"] for span in line["spans"]) for line in block["lines"])
+        blocks.append((tuple(block["bbox"]), text))
+    return blocks
 
-        for img_index, img in enumerate(image_list):
-            try:
-                # 提取图片
-                xref = img[0]
-                base_image = doc.extract_image(xref)
-                image_bytes = base_image["image"]
-                image_ext = base_image["ext"]  # 图片格式（如 png、jpeg）
-
-                # 保存图片到文件
-                raw_filename = f"page_{page_index + 1}_img_{img_index + 1}.{image_ext}"
-                raw_output_path = os.path.join(pdf_output_dir, raw_filename)
-                with open(raw_output_path, "wb") as f:
-                    f.write(image_bytes)
-
-                # 构建相对路径
-                relative_path = os.path.relpath(raw_output_path, "static")
-
-                # 保存图片信息
-                results.append({
-                    "page": page_index + 1,
-                    "image_index": img_index + 1,
-                    "image_path": relative_path  # 返回相对路径
-                })
-
-                print(f"[DEBUG] 原始图片已保存到 {raw_output_path}。")
 
-            except Exception as e:
-                print(f"[ERROR] 提取第 {page_index + 1} 页，第 {img_index + 1} 张图片失败：{e}")
+def _page_captions(page, page_results, blocks):
+    """
+    按几何距离为每张图片匹配最近的图注（写入 caption 字段）。
+    :param blocks: _page_text_blocks 返回的文本块
+    :return: 页面文本
+    """
+    captions = CaptionIndex(blocks)
+
+    image_rects = {}
+    if len(captions) > 1 and any("xref" in result for result in page_results):
+        for info in page.get_image_info(xrefs=True):
+            image_rects.setdefault(info["xref"], info["bbox"])
+    for result in page_results:
+        bbox = result.get("bbox") or image_rects.get(result.get("xref"))
+        result["caption"] = captions.nearest(bbox)
+    return "\n".join(text for _, text in blocks)
+
+
+def _union(a, b):
+    return min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3])
+
+
+def _expand(rect, margin):
+    return rect[0] - margin, rect[1] - margin, rect[2] + margin, rect[3] + margin
+
+
+def _intersects(a, b):
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+
+def _overlap_ratio(rect, other):
+    """rect 被 other 覆盖的面积比例"""
+    width = min(rect[2], other[2]) - max(rect[0], other[0])
+    height = min(rect[3], other[3]) - max(rect[1], other[1])
+    area = (rect[2] - rect[0]) * (rect[3] - rect[1])
+    if width <= 0 or height <= 0 or area <= 0:
+        return 0
+    return width * height / area
+
+
+def _touching_groups(rects, gap):
+    """
+    用并查集把外扩 gap 后相交的矩形分为一组。
+    矩形登记到边长为 gap（至少 1pt）的网格中，只与外扩范围内网格里的矩形比较，
+    耗时与矩形覆盖的网格数成正比，不随矩形数量平方增长。
+    :return: 每个矩形所属组的根下标列表
+    """
+    parent = list(range(len(rects)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    cell = max(gap, 1)
+    # 网格边长不超过 gap 时，同一网格中的矩形相距不超过 gap，必然属于同一组：登记时直接合并；
+    # 查询时网格的第一个矩形已在同一组就跳过整个网格，找到一个相交的矩形后也不必再比较其余矩形
+    same_cell_touching = gap >= cell
+
+    def cells(rect):
+        for cx in range(math.floor(rect[0] / cell), math.floor(rect[2] / cell) + 1):
+            for cy in range(math.floor(rect[1] / cell), math.floor(rect[3] / cell) + 1):
+                yield cx, cy
+
+    grid = {}
+    for i, rect in enumerate(rects):
+        for key in cells(rect):
+            members = grid.setdefault(key, [])
+            if same_cell_touching and members:
+                parent[find(members[0])] = find(i)
+            members.append(i)
+        expanded = _expand(rect, gap)
+        for key in cells(expanded):
+            members = grid.get(key)
+            if not members or (same_cell_touching and find(members[0]) == find(i)):
+                continue
+            for j in members:
+                if find(j) != find(i) and _intersects(expanded, rects[j]):
+                    parent[find(j)] = find(i)
+                    if same_cell_touching:
+                        break
+    return [find(i) for i in range(len(rects))]
+
+
+def _cluster_rects(rects, gap=DRAWING_CLUSTER_GAP):
+    """
+    把间距不超过 gap 的矩形合并为簇；簇的外接矩形之间仍然相邻时继续合并，直到没有可合并的簇。
+    :return: [(簇的外接矩形, 矩形数量)]，按位置排序
+    """
+    clusters = [(tuple(rect), 1) for rect in rects]
+    while True:
+        groups = {}
+        for (box, count), root in zip(clusters, _touching_groups([box for box, _ in clusters], gap)):
+            if root in groups:
+                other, other_count = groups[root]
+                groups[root] = (_union(box, other), count + other_count)
+            else:
+                groups[root] = (box, count)
+        if len(groups) == len(clusters):
+            return sorted(clusters, key=lambda cluster: (cluster[0][1], cluster[0][0]))
+        clusters = list(groups.values())
+
 
+def _detect_figure_regions(page, blocks):
+    """
+    根据绘图路径的聚集位置和图注检测矢量图区域。
+    路径数量足够、或附近有图注的簇视为图形；共用同一图注的簇（如子图）合并为一个区域；
+    区域会扩展到主要落在其中的文字（坐标轴标签等），但不包含图注本身。
+    :param blocks: _page_text_blocks 返回的文本块
+    :return: 区域矩形列表，按阅读顺序排列
+    """
+    page_rect = tuple(page.rect)
+    page_area = (page_rect[2] - page_rect[0]) * (page_rect[3] - page_rect[1])
+    rects = []
+    for drawing in page.get_drawings():
+        rect = tuple(drawing["rect"])
+        # 跳过页面背景、边框等覆盖整页的路径
+        if (rect[2] - rect[0]) * (rect[3] - rect[1]) > 0.9 * page_area:
+            continue
+        rects.append(rect)
+    if not rects:
+        return []
+
+    image_rects = [tuple(info["bbox"]) for info in page.get_image_info()]
+    caption_blocks, plain_blocks = [], []
+    for bbox, text in blocks:
+        label = find_figure_number(text)
+        if label:
+            caption_blocks.append((bbox, label))
+        else:
+            plain_blocks.append(bbox)
+
+    regions = set()
+    for bbox, count in _clusters_by_caption(_cluster_rects(rects), caption_blocks):
+        # 位图的边框或裁剪路径已经作为位图提取
+        if any(_overlap_ratio(bbox, image_rect) > 0.8 for image_rect in image_rects):
+            continue
+        near_caption = any(rect_distance(bbox, caption_bbox) <= CAPTION_MAX_DISTANCE
+                           for caption_bbox, _ in caption_blocks)
+        if count < MIN_FIGURE_DRAWINGS and not near_caption:
+            continue
+
+        for text_bbox in plain_blocks:
+            if _overlap_ratio(text_bbox, _expand(bbox, DRAWING_CLUSTER_GAP)) >= 0.5:
+                bbox = _union(bbox, text_bbox)
+        bbox = (max(bbox[0], page_rect[0]), max(bbox[1], page_rect[1]),
+                min(bbox[2], page_rect[2]), min(bbox[3], page_rect[3]))
+        if bbox[2] - bbox[0] < MIN_FIGURE_SIZE or bbox[3] - bbox[1] < MIN_FIGURE_SIZE:
+            continue
+        regions.add(bbox)
+
+    return sorted(regions, key=lambda region: (region[1], region[0]))
+
+
+def _clusters_by_caption(clusters, caption_blocks):
+    """把距离同一图注不超过 CAPTION_MAX_DISTANCE 的簇合并（一个图注下的多个子图）"""
+    if not caption_blocks:
+        return clusters
+    grouped = {}
+    rest = []
+    for bbox, count in clusters:
+        distance, caption_bbox = min((rect_distance(bbox, caption_bbox), caption_bbox)
+                                     for caption_bbox, _ in caption_blocks)
+        if distance > CAPTION_MAX_DISTANCE:
+            rest.append((bbox, count))
+            continue
+        if caption_bbox in grouped:
+            other, other_count = grouped[caption_bbox]
+            grouped[caption_bbox] = (_union(bbox, other), count + other_count)
+        else:
+            grouped[caption_bbox] = (bbox, count)
+    return rest + list(grouped.values())
+
+
+def _render_vector_figures(page, page_index, pdf_output_dir, blocks, dpi, start_index=1):
+    """
+    检测页面中的矢量图区域，只按裁剪矩形渲染这些区域并保存为 PNG。
+    :param blocks: _page_text_blocks 返回的文本块
+    :param dpi: 渲染分辨率
+    :param start_index: 第一个区域的 image_index（排在该页位图之后）
+    :return: 图片信息列表，bbox 字段为区域在页面中的位置（pt）
+    """
+    results = []
+    for offset, bbox in enumerate(_detect_figure_regions(page, blocks)):
+        image_index = start_index + offset
+        try:
+            pixmap = page.get_pixmap(clip=fitz.Rect(bbox), dpi=dpi)
+            output_path = os.path.join(pdf_output_dir, f"page_{page_index + 1}_fig_{image_index}.png")
+            pixmap.save(output_path)
+        except Exception as e:
+            print(f"[ERROR] 渲染第 {page_index + 1} 页的矢量图区域 {bbox} 失败：{e}")
+            continue
+        results.append({
+            "page": page_index + 1,
+            "image_index": image_index,
+            "image_path": os.path.relpath(output_path, "static"),
+            "bbox": [round(value, 2) for value in bbox],
+            "vector": True,
+        })
+        print(f"[DEBUG] 矢量图区域已渲染到 {output_path}（{pixmap.width}x{pixmap.height}）")
     return results
 
 
-def extract_figure_number(text):
+def _iter_pages_from_doc(doc, page_indices, pdf_output_dir, with_text=False, dedupe=None, vector_dpi=None):
     """
-    使用正则表达式从文本中提取图号。
-    :param text: 提取的页面文本
-    :return: 提取到的图号或 None
+    在已打开的文档中逐页提取图片。
+    :param with_text: 是否提取页面文本，并为每张图片匹配最近的图注（caption 字段）
+    :param vector_dpi: 渲染矢量图区域的 DPI，None 表示只提取位图
+    :return: 生成器，逐页产出 (页码索引, 该页图片信息列表, 页面文本或 None)，跳过没有图片的页
+    """
+    dedupe = dedupe if dedupe is not None else _new_dedupe_state()
+    for page_index in page_indices:
+        page = doc[page_index]
+        page_results = _extract_page_images(doc, page_index, pdf_output_dir, dedupe)
+        blocks = None
+        if vector_dpi:
+            try:
+                blocks = _page_text_blocks(page)
+                page_results += _render_vector_figures(page, page_index, pdf_output_dir, blocks, vector_dpi,
+                                                       start_index=len(page_results) + 1)
+            except Exception as e:
+                print(f"[ERROR] 第 {page_index + 1} 页矢量图检测失败：{e}")
+        if not page_results:
+            continue
+        page_text = None
+        if with_text:
+            try:
+                blocks = blocks if blocks is not None else _page_text_blocks(page)
+                page_text = _page_captions(page, page_results, blocks)
+            except Exception as e:
+                print(f"[ERROR] 第 {page_index + 1} 页文本提取失败：{e}")
+        yield page_index, page_results, page_text
+
+
+def _extract_pages_from_doc(doc, page_indices, pdf_output_dir, with_text=False, dedupe=None, vector_dpi=None):
+    """与 _iter_pages_from_doc 相同，但返回列表"""
+    return list(_iter_pages_from_doc(doc, page_indices, pdf_output_dir, with_text, dedupe, vector_dpi))
+
+
+def _extract_pages_worker(pdf_path, page_indices, pdf_output_dir, with_text=False, dedupe=None, vector_dpi=None):
+    """工作进程入口：各自打开文档并处理分到的页块"""
+    with fitz.open(pdf_path) as doc:
+        return _extract_pages_from_doc(doc, page_indices, pdf_output_dir, with_text, dedupe, vector_dpi)
+
+
+def _iter_pages(pdf_path, target_pages, pdf_output_dir, workers=1, with_text=False, dedupe_content=False,
+                vector_dpi=None):
+    """
+    提取目标页中的图片，workers > 1 时按页块分给多个进程并行处理（矢量图区域也在各进程中渲染），
+    结果按页码顺序逐页产出。
+    :param workers: 进程数，None 表示 CPU 核数
+    :param dedupe_content: 是否按内容摘要合并不同 xref 的相同图片
+    :param vector_dpi: 渲染矢量图区域的 DPI，None 表示只提取位图
+    :return: 生成器，与 _iter_pages_from_doc 相同
     """
-    patterns = [
-        r"Fig(?:ure)?\.?\s?\d+(\.\d+)?",  # 匹配 'Fig. 1.1' 或 'Figure 1.2'
-        r"图\d+(\.\d+)?",                # 匹配 '图1.1' 或 '图2'
-    ]
-    for pattern in patterns:
-        match = re.search(pattern, text, re.IGNORECASE)
-        if match:
-            return match.group(0)
-    return None
+    workers = workers or os.cpu_count() or 1
+    with fitz.open(pdf_path) as doc:
+        page_indices = _target_page_indices(len(doc), target_pages)
+        if workers <= 1 or len(page_indices) < PARALLEL_MIN_PAGES:
+            yield from _link_shared_images(_iter_pages_from_doc(doc, page_indices, pdf_output_dir, with_text,
+                                                                _new_dedupe_state(dedupe_content), vector_dpi))
+            return
+        dedupe = _new_dedupe_state(dedupe_content, _image_owners(doc, page_indices))
 
+    chunks = _split_chunks(page_indices, workers * CHUNKS_PER_WORKER)
+    print(f"[DEBUG] 使用 {workers} 个进程并行提取 {len(page_indices)} 页（{len(chunks)} 个页块）")
+    executor = ProcessPoolExecutor(max_workers=min(workers, len(chunks)))
+    try:
+        futures = [executor.submit(_extract_pages_worker, pdf_path, chunk, pdf_output_dir, with_text, dedupe,
+                                   vector_dpi)
+                   for chunk in chunks]
+        # 按提交顺序等待各页块，页块本身是连续的，因此逐块产出时仍按页码排序
+        yield from _link_shared_images(page for future in futures for page in future.result())
+    finally:
+        # 提前关闭（如客户端断开）或出错时取消尚未开始的页块，并等待正在运行的页块结束，
+        # 返回后不会再有进程向输出目录写入图片
+        executor.shutdown(wait=True, cancel_futures=True)
 
-def process_pdf_with_regex(pdf_path, output_dir, target_pages=None):
+
+def iter_images(pdf_path, output_dir, target_pages=None, workers=1, dedupe_content=False, vector_dpi=None):
+    """
+    extract_images 的生成器版本：每张图片保存后立即产出其信息，适合流式返回结果。
+    参数与 extract_images 相同。
     """
-    提取 PDF 图片，并使用正则表达式识别图号。无法识别时自动生成序号。
+    pdf_output_dir = _pdf_output_dir(pdf_path, output_dir)
+    for _, page_results, _ in _iter_pages(pdf_path, target_pages, pdf_output_dir, workers,
+                                          dedupe_content=dedupe_content, vector_dpi=vector_dpi):
+        yield from page_results
+
+
+def extract_images(pdf_path, output_dir, target_pages=None, workers=1, dedupe_content=False, vector_dpi=None):
+    """
+    从 PDF 中提取原始图片并保存到指定目录。
+    重复出现的图片（同一 xref）只保存一次，每个出现位置都会出现在结果中并指向同一个文件。
 
     :param pdf_path: PDF 文件路径
     :param output_dir: 图片保存目录
-    :param target_pages: 目标页码列表，仅处理这些页码
-    :return: 包含图片路径、图号等信息的列表
+    :param target_pages: 需要处理的页码（1-based 列表或 PageRangeSet），None 表示处理所有页码
+    :param workers: 并行提取的进程数，1 表示不并行，None 表示 CPU 核数
+    :param dedupe_content: 是否把不同 xref 但字节完全相同的图片也合并为一个文件
+    :param vector_dpi: 同时检测矢量图（图表等）区域并按该 DPI 只渲染区域，None 表示只提取位图；
+                       矢量图结果带有 vector 和 bbox 字段
+    :return: 包含图片路径（相对路径）和元信息的列表
     """
-    all_results = extract_images(pdf_path, output_dir, target_pages)
-    figure_counter = 1  # 自动生成图号的计数器
+    return list(iter_images(pdf_path, output_dir, target_pages, workers, dedupe_content, vector_dpi))
+
+
+def extract_figure_number(text):
+    """
+    使用正则表达式从文本中提取图号。
+    :param text: 提取的页面文本
+    :return: 提取到的图号或 None
+    """
+    return find_figure_number(text)
 
-    doc = fitz.open(pdf_path)  # 打开 PDF，用于提取文本
 
-    for result in all_results:
-        page_number = result["page"]
-        print(f"[DEBUG] 处理第 {page_number} 页图片：{result['image_path']}")
+def iter_pdf_with_regex(pdf_path, output_dir, target_pages=None, include_page_text=False, workers=1,
+                        dedupe_content=False, vector_dpi=None):
+    """
+    process_pdf_with_regex 的生成器版本：逐张产出带图号的图片信息，参数与 process_pdf_with_regex 相同。
+    """
+    pdf_output_dir = _pdf_output_dir(pdf_path, output_dir)
+    figure_counter = 1  # 自动生成图号的计数器
 
-        try:
-            # 提取页面文本
-            page_text = doc[page_number - 1].get_text()
-            figure_number = extract_figure_number(page_text)
+    for page_index, page_results, page_text in _iter_pages(pdf_path, target_pages, pdf_output_dir, workers,
+                                                           with_text=True, dedupe_content=dedupe_content,
+                                                           vector_dpi=vector_dpi):
+        print(f"[DEBUG] 处理第 {page_index + 1} 页的 {len(page_results)} 张图片")
 
+        for result in page_results:
+            figure_number = result.pop("caption", None)
             # 如果未找到图号，则自动生成
             if not figure_number:
                 figure_number = f"Figure {figure_counter}"
                 figure_counter += 1
 
-            result.update({
-                "figure_number": figure_number,
-                "page_text": page_text
-            })
+            result["figure_number"] = figure_number
+            if include_page_text:
+                result["page_text"] = page_text if page_text is not None else "N/A"
             print(f"[DEBUG] 图号提取成功：{figure_number}")
+            yield result
 
-        except Exception as e:
-            print(f"[ERROR] 图号提取失败：{e}")
-            result.update({
-                "figure_number": f"Figure {figure_counter}",
-                "page_text": "N/A"
-            })
-            figure_counter += 1
-
-    return all_results
\ No newline at end of file
+
+def process_pdf_with_regex(pdf_path, output_dir, target_pages=None, include_page_text=False, workers=1,
+                           dedupe_content=False, vector_dpi=None):
+    """
+    提取 PDF 图片，并为每张图片匹配页面中几何距离最近的图注。无法识别时自动生成序号。
+    每页的文本块只遍历一次。
+
+    :param pdf_path: PDF 文件路径
+    :param output_dir: 图片保存目录
+    :param target_pages: 目标页码（1-based 列表或 PageRangeSet），仅处理这些页码
+    :param include_page_text: 是否在结果中附带页面全文（page_text）
+    :param workers: 并行提取的进程数，1 表示不并行，None 表示 CPU 核数
+    :param dedupe_content: 是否把不同 xref 但字节完全相同的图片也合并为一个文件
+    :param vector_dpi: 同时检测矢量图区域并按该 DPI 只渲染区域，None 表示只提取位图
+    :return: 包含图片路径、图号等信息的列表
+    """
+    return list(iter_pdf_with_regex(pdf_path, output_dir, target_pages, include_page_text, workers,
+                                    dedupe_content, vector_dpi))
@@ -1,68 +1,291 @@
 import os
-import re
+import posixpath
+import shutil
+import zipfile
+import xml.etree.ElementTree as ET
 from pptx import Presentation
 
+from caption_match import CaptionIndex, find_figure_number
+from page_range import PageRangeSet
 
-def extract_images_from_pptx(pptx_path, output_dir, target_slides=None):
+# PPTX（OOXML）中用到的命名空间
+_NS = {
+    'a': 'http://schemas.openxmlformats.org/drawingml/2006/main',
+    'p': 'http://schemas.openxmlformats.org/presentationml/2006/main',
+    'r': 'http://schemas.openxmlformats.org/officeDocument/2006/relationships',
+    'rel': 'http://schemas.openxmlformats.org/package/2006/relationships',
+}
+# 与 python-pptx 的 image.ext 保持一致的扩展名
+_MEDIA_EXTENSIONS = {'jpeg': 'jpg', 'jpe': 'jpg', 'tif': 'tiff'}
+# 版式占位符没有位置时，按该类型查找母版中的占位符（与 python-pptx 的 LayoutPlaceholder 一致），未列出的类型按原类型查找
+_MASTER_PLACEHOLDER_TYPES = {
+    'chart': 'body', 'clipArt': 'body', 'dgm': 'body', 'media': 'body', 'obj': 'body',
+    'pic': 'body', 'subTitle': 'body', 'tbl': 'body', 'ctrTitle': 'title',
+}
+
+
+def extract_images_from_pptx(pptx_path, output_dir, target_slides=None, fast=False):
     """
     从 PPT 文件中提取图片并保存到指定目录，同时提取包含图号的文本。
     :param pptx_path: PPT 文件路径
     :param output_dir: 图片保存目录
-    :param target_slides: 需要处理的幻灯片索引列表，None 表示处理所有幻灯片
+    :param target_slides: 需要处理的幻灯片序号（1-based 列表或 PageRangeSet），None 表示处理所有幻灯片
+    :param fast: 是否直接按 ZIP 读取媒体文件（不加载 python-pptx 对象模型），见 iter_images_from_pptx_zip
     :return: 包含图片路径和图号的列表
     """
+    return list(iter_images_from_pptx(pptx_path, output_dir, target_slides, fast))
+
+
+def iter_images_from_pptx(pptx_path, output_dir, target_slides=None, fast=False):
+    """
+    extract_images_from_pptx 的生成器版本：每张图片保存后立即产出其信息，参数相同。
+    """
+    if fast:
+        yield from iter_images_from_pptx_zip(pptx_path, output_dir, target_slides)
+        return
+
     # 获取 PPT 文件名（无扩展名）
     ppt_name = os.path.splitext(os.path.basename(pptx_path))[0]
     ppt_output_dir = os.path.join(output_dir, ppt_name)
     os.makedirs(ppt_output_dir, exist_ok=True)
 
     prs = Presentation(pptx_path)
-    results = []
+
+    slides = prs.slides
+    # 只遍历指定范围内的幻灯片
+    if target_slides:
+        slide_indices = PageRangeSet.from_pages(target_slides).clamp(1, len(slides))
+    else:
+        slide_indices = range(1, len(slides) + 1)
 
     image_counter = 1
-    for slide_index, slide in enumerate(prs.slides, start=1):
-        # 如果有指定的幻灯片范围且当前幻灯片不在范围内，跳过
-        if target_slides and slide_index not in target_slides:
-            continue
+    for slide_index in slide_indices:
+        slide = slides[slide_index - 1]
 
-        # 提取幻灯片中的所有文本
-        all_text = ""
+        # 一次遍历幻灯片中的形状：收集带位置的文本块和图片
+        blocks = []
+        pictures = []
         for shape in slide.shapes:
             if shape.has_text_frame:
-                all_text += shape.text_frame.text + " "
+                blocks.append((_shape_bbox(shape), shape.text_frame.text))
+            elif shape.shape_type == 13:  # 图片类型
+                pictures.append(shape)
+        captions = CaptionIndex(blocks)
 
-        for shape in slide.shapes:
-            if shape.shape_type == 13:  # 图片类型
-                image = shape.image
-                image_bytes = image.blob
-                image_ext = image.ext  # 图片扩展名
+        for shape in pictures:
+            image = shape.image
+            image_bytes = image.blob
+            image_ext = image.ext  # 图片扩展名
+
+            # 保存图片
+            image_filename = f"slide_{slide_index}_img_{image_counter}.{image_ext}"
+            image_output_path = os.path.join(ppt_output_dir, image_filename)
+            with open(image_output_path, "wb") as f:
+                f.write(image_bytes)
+
+            # 匹配距离图片最近的图注
+            figure_number = captions.nearest(_shape_bbox(shape))
+
+            # 如果没有图号，自动生成
+            if not figure_number:
+                figure_number = f"Figure {image_counter}"
+
+            # 构建相对路径
+            relative_path = os.path.relpath(image_output_path, "static")
+
+            yield {
+                "slide": slide_index,
+                "image_index": image_counter,
+                "image_path": relative_path,
+                "figure_number": figure_number,
+            }
+            image_counter += 1
+
+
+def _shape_bbox(shape):
+    """形状的矩形 (x0, y0, x1, y1)（EMU），位置未知时返回 None"""
+    if None in (shape.left, shape.top, shape.width, shape.height):
+        return None
+    return shape.left, shape.top, shape.left + shape.width, shape.top + shape.height
+
+
+def _read_rels(archive, part_name):
+    """
+    读取部件的关系文件。
+    :return: {关系 ID: 目标部件名}，不包含外部链接
+    """
+    rels_name = posixpath.join(posixpath.dirname(part_name), '_rels', posixpath.basename(part_name) + '.rels')
+    try:
+        root = ET.fromstring(archive.read(rels_name))
+    except KeyError:
+        return {}
+    base_dir = posixpath.dirname(part_name)
+    rels = {}
+    for rel in root.findall('rel:Relationship', _NS):
+        if rel.get('TargetMode') == 'External':
+            continue
+        target = rel.get('Target')
+        if target.startswith('/'):
+            rels[rel.get('Id')] = target.lstrip('/')
+        else:
+            rels[rel.get('Id')] = posixpath.normpath(posixpath.join(base_dir, target))
+    return rels
+
+
+def _slide_parts(archive):
+    """按演示文稿中的顺序返回幻灯片部件名列表"""
+    presentation = 'ppt/presentation.xml'
+    rels = _read_rels(archive, presentation)
+    root = ET.fromstring(archive.read(presentation))
+    return [rels[sld_id.get(f"{{{_NS['r']}}}id")]
+            for sld_id in root.iterfind('p:sldIdLst/p:sldId', _NS)]
 
-                # 保存图片
-                image_filename = f"slide_{slide_index}_img_{image_counter}.{image_ext}"
-                image_output_path = os.path.join(ppt_output_dir, image_filename)
-                with open(image_output_path, "wb") as f:
-                    f.write(image_bytes)
 
-                # 提取图号（如果存在）
-                figure_number = extract_figure_number(all_text)
+def _xml_shape_bbox(shape):
+    """由形状 XML 中的 a:xfrm 计算矩形 (x0, y0, x1, y1)（EMU），继承版式或母版位置的占位符返回 None"""
+    xfrm = shape.find('p:spPr/a:xfrm', _NS)
+    if xfrm is None:
+        return None
+    off, ext = xfrm.find('a:off', _NS), xfrm.find('a:ext', _NS)
+    if off is None or ext is None:
+        return None
+    x, y = int(off.get('x')), int(off.get('y'))
+    return x, y, x + int(ext.get('cx')), y + int(ext.get('cy'))
 
-                # 如果没有图号，自动生成
-                if not figure_number:
-                    figure_number = f"Figure {image_counter}"
 
-                # 构建相对路径
-                relative_path = os.path.relpath(image_output_path, "static")
+def _placeholder(shape):
+    """形状的占位符元素 p:ph，不是占位符时返回 None"""
+    return shape.find('./*/p:nvPr/p:ph', _NS)
 
-                results.append({
+
+def _part_placeholders(archive, part_name):
+    """依次产出版式或母版部件中的占位符 (idx, 类型, 矩形或 None)，idx 与类型使用 OOXML 的默认值"""
+    try:
+        sp_tree = ET.fromstring(archive.read(part_name)).find('p:cSld/p:spTree', _NS)
+    except KeyError:
+        return
+    for shape in sp_tree if sp_tree is not None else ():
+        ph = _placeholder(shape)
+        if ph is not None:
+            yield ph.get('idx', '0'), ph.get('type', 'obj'), _xml_shape_bbox(shape)
+
+
+def _layout_placeholder_bboxes(archive, layout_part, masters):
+    """
+    版式中各占位符的位置 {idx: 矩形或 None}，用于解析继承位置的幻灯片占位符。
+    与 python-pptx 相同：幻灯片占位符按 idx 继承版式，版式占位符没有位置时再按类型继承母版。
+    :param masters: 母版部件名 -> {占位符类型: 矩形或 None}，在多个版式之间共用
+    """
+    master_part = next((target for target in _read_rels(archive, layout_part).values()
+                        if '/slideMasters/' in f"/{target}"), None)
+    if master_part is not None and master_part not in masters:
+        master = masters[master_part] = {}
+        for _, ph_type, bbox in _part_placeholders(archive, master_part):
+            master.setdefault(ph_type, bbox)
+    master = masters.get(master_part, {})
+
+    bboxes = {}
+    for idx, ph_type, bbox in _part_placeholders(archive, layout_part):
+        if idx not in bboxes:
+            bboxes[idx] = bbox or master.get(_MASTER_PLACEHOLDER_TYPES.get(ph_type, ph_type))
+    return bboxes
+
+
+def _slide_blocks_and_pictures(slide_xml, layout_bboxes=None):
+    """
+    一次遍历幻灯片 XML 的顶层形状（与 python-pptx 的 slide.shapes 一致），收集文本块和图片。
+    :param layout_bboxes: 版式占位符位置（已按母版补全），见 _layout_placeholder_bboxes
+    :return: ([(矩形或 None, 文本)], [(关系 ID, 矩形或 None)])
+    """
+    layout_bboxes = layout_bboxes or {}
+    sp_tree = ET.fromstring(slide_xml).find('p:cSld/p:spTree', _NS)
+    if sp_tree is None:
+        return [], []
+
+    blocks = []
+    pictures = []
+    for shape in sp_tree:
+        if shape.tag == f"{{{_NS['p']}}}sp":
+            tx_body = shape.find('p:txBody', _NS)
+            if tx_body is not None:
+                paragraphs = ["".join(t.text or "" for t in paragraph.iter(f"{{{_NS['a']}}}t"))
+                              for paragraph in tx_body.findall('a:p', _NS)]
+                bbox = _xml_shape_bbox(shape)
+                ph = _placeholder(shape)
+                if bbox is None and ph is not None:
+                    bbox = layout_bboxes.get(ph.get('idx', '0'))
+                blocks.append((bbox, "\n".join(paragraphs)))
+        elif shape.tag == f"{{{_NS['p']}}}pic":
+            # 图片占位符不算作图片（python-pptx 中其类型为占位符）
+            if _placeholder(shape) is not None:
+                continue
+            blip = shape.find('p:blipFill/a:blip', _NS)
+            embed = blip.get(f"{{{_NS['r']}}}embed") if blip is not None else None
+            if embed:
+                pictures.append((embed, _xml_shape_bbox(shape)))
+    return blocks, pictures
+
+
+def iter_images_from_pptx_zip(pptx_path, output_dir, target_slides=None):
+    """
+    快速模式：直接按 ZIP 读取 PPTX，只解析请求的幻灯片及其关系文件，
+    把引用的 ppt/media/* 按块写入磁盘，不构建 python-pptx 对象模型。
+    返回的字段与 iter_images_from_pptx 相同；多页共用的媒体文件只写入一次，之后的出现指向同一个文件。
+    """
+    ppt_name = os.path.splitext(os.path.basename(pptx_path))[0]
+    ppt_output_dir = os.path.join(output_dir, ppt_name)
+    os.makedirs(ppt_output_dir, exist_ok=True)
+
+    with zipfile.ZipFile(pptx_path) as archive:
+        slide_parts = _slide_parts(archive)
+        if target_slides:
+            slide_indices = PageRangeSet.from_pages(target_slides).clamp(1, len(slide_parts))
+        else:
+            slide_indices = range(1, len(slide_parts) + 1)
+
+        saved = {}    # 媒体部件名 -> 已保存图片的相对路径
+        layouts = {}  # 版式部件名 -> 占位符位置
+        masters = {}  # 母版部件名 -> 占位符位置
+        image_counter = 1
+        for slide_index in slide_indices:
+            slide_part = slide_parts[slide_index - 1]
+            rels = _read_rels(archive, slide_part)
+            layout_part = next((target for target in rels.values() if '/slideLayouts/' in f"/{target}"), None)
+            if layout_part is not None and layout_part not in layouts:
+                layouts[layout_part] = _layout_placeholder_bboxes(archive, layout_part, masters)
+            blocks, pictures = _slide_blocks_and_pictures(archive.read(slide_part), layouts.get(layout_part))
+            if not pictures:
+                continue
+            captions = CaptionIndex(blocks)
+
+            for embed, bbox in pictures:
+                media_part = rels.get(embed)
+                if media_part is None:
+                    print(f"[WARNING] 第 {slide_index} 张幻灯片的图片关系 {embed} 无法解析，已跳过")
+                    continue
+
+                relative_path = saved.get(media_part)
+                if relative_path is None:
+                    image_ext = posixpath.splitext(media_part)[1].lstrip('.').lower()
+                    image_ext = _MEDIA_EXTENSIONS.get(image_ext, image_ext)
+                    image_filename = f"slide_{slide_index}_img_{image_counter}.{image_ext}"
+                    image_output_path = os.path.join(ppt_output_dir, image_filename)
+                    try:
+                        with archive.open(media_part) as src, open(image_output_path, "wb") as dst:
+                            shutil.copyfileobj(src, dst)
+                    except KeyError:
+                        print(f"[WARNING] 媒体文件 {media_part} 不存在，已跳过")
+                        continue
+                    relative_path = saved[media_part] = os.path.relpath(image_output_path, "static")
+
+                yield {
                     "slide": slide_index,
                     "image_index": image_counter,
                     "image_path": relative_path,
-                    "figure_number": figure_number,
-                })
+                    "figure_number": captions.nearest(bbox) or f"Figure {image_counter}",
+                }
                 image_counter += 1
 
-    return results
-
 
 def extract_figure_number(text):
     """
@@ -70,12 +293,4 @@ def extract_figure_number(text):
     :param text: 提取的页面文本
     :return: 提取到的图号或 None
     """
-    patterns = [
-        r"Fig(?:ure)?\.?\s?\d+(\.\d+)?",  # 匹配 'Fig. 1.1' 或 'Figure 1.2'
-        r"图\d+(\.\d+)?",                # 匹配 '图1.1' 或 '图2'
-    ]
-    for pattern in patterns:
-        match = re.search(pattern, text, re.IGNORECASE)
-        if match:
-            return match.group(0)
-    return None
\ No newline at end of file
+    return find_figure_number(text)
@@ -1,7 +1,13 @@
+import io
+import mimetypes
 import os
-from flask import Flask, request, render_template, url_for, redirect, send_file, send_from_directory
-from image_text_editor import extract_text_and_boxes, replace_text_in_image
-from image_color_edit import replace_line_color
+import shutil
+import tempfile
+from flask import Flask, abort, request, render_template, url_for, redirect, send_file, send_from_directory
+from PIL import Image
+from batch_editor import run_batch
+from edit_history import get_history, HISTORY_FOLDER
+from image_editor import extract_text_and_boxes, TILED_PIXEL_THRESHOLD
 from werkzeug.utils import secure_filename
 
 app = Flask(__name__)
@@ -17,6 +23,46 @@ os.makedirs(RESULT_FOLDER, exist_ok=True)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['OUTPUT_FOLDER'] = OUTPUT_FOLDER
 app.config['RESULT_FOLDER'] = RESULT_FOLDER
+app.config['HISTORY_FOLDER'] = HISTORY_FOLDER
+# 超过该像素数量的图片在颜色修改时使用分块模式
+app.config['TILED_PIXEL_THRESHOLD'] = TILED_PIXEL_THRESHOLD
+# OCR 预处理参数（True 表示使用默认参数，False 表示关闭，也可以传入字典覆盖部分参数）
+app.config['OCR_PREPROCESS'] = True
+# 是否额外保存文字修改后的中间结果到 outputs/
+app.config['SAVE_INTERMEDIATE'] = False
+# 批量编辑的进程数（None 表示 CPU 核数）
+app.config['BATCH_WORKERS'] = None
+
+
+def parse_region(values):
+    """
+    从表单或查询参数中解析 OCR 选区 (x, y, w, h)，未填写时返回 None
+    """
+    fields = [values.get(name, '').strip() for name in ('region_x', 'region_y', 'region_w', 'region_h')]
+    if not all(fields):
+        return None
+    try:
+        return tuple(int(float(v)) for v in fields)
+    except ValueError:
+        return None
+
+
+def _history(filename, reset=False):
+    """
+    获取上传图片的编辑历史（原图只保存在 uploads/，每一步只保存变化的图块），
+    图片没有上传过时返回 404
+    """
+    filename = secure_filename(filename)
+    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    if not os.path.isfile(filepath):
+        abort(404)
+    return get_history(filename, filepath, app.config['HISTORY_FOLDER'], reset=reset)
+
+
+def _image_format(filename):
+    """根据扩展名确定编码格式，未知扩展名时使用 PNG"""
+    ext = os.path.splitext(filename)[1].lower() or '.png'
+    return Image.registered_extensions().get(ext, 'PNG'), ext
 
 
 @app.route('/', methods=['GET', 'POST'])
@@ -37,6 +83,8 @@ def index():
         filename = secure_filename(file.filename)
         filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
         file.save(filepath)
+        # 重新上传同名文件时丢弃旧的编辑历史
+        _history(filename, reset=True)
 
         # 重定向至修改页面
         return redirect(url_for('edit_options', filename=filename))
@@ -47,50 +95,121 @@ def index():
 @app.route('/edit/<filename>', methods=['GET', 'POST'])
 def edit_options(filename):
     """
-    修改页面：文字修改与颜色修改
+    修改页面：文字修改与颜色修改（基于编辑历史的当前版本）
     """
-    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-
-    # 提取图片中的文字及其位置信息
-    text_boxes = extract_text_and_boxes(filepath)
+    history = _history(filename)
+    region = parse_region(request.values)
 
     if request.method == 'POST':
-        # 获取用户输入的文字修改选项
-        original_text = request.form.get('original_text', '').strip()
-        replacement_text = request.form.get('replacement_text', '').strip()
+        # 获取用户输入的文字修改选项（支持多组）
+        replacements = [
+            (original.strip(), replacement.strip())
+            for original, replacement in zip(request.form.getlist('original_text'),
+                                             request.form.getlist('replacement_text'))
+            if original.strip() and replacement.strip()
+        ]
 
         # 获取用户输入的颜色修改选项
         target_color = request.form.get('target_color', '').strip()
         replacement_color = request.form.get('replacement_color', '').strip()
+        color_pairs = []
+        if target_color and replacement_color and target_color.lower() != replacement_color.lower():
+            color_pairs.append((target_color, replacement_color))
 
-        # 执行文字修改
-        output_filepath = os.path.join(app.config['OUTPUT_FOLDER'], filename)
-        if original_text and replacement_text:
-            replace_text_in_image(filepath, original_text, replacement_text, output_filepath)
-        else:
-            # 如果未进行文字修改，直接复制原文件到输出路径
-            os.system(f'cp "{filepath}" "{output_filepath}"')
-
-        # 执行颜色修改
-        result_filepath = os.path.join(app.config['RESULT_FOLDER'], f"result_{filename}")
-        if target_color and replacement_color:
-            replace_line_color(output_filepath, target_color, replacement_color, result_filepath)
-        else:
-            # 如果未进行颜色修改，直接复制文字修改后的文件到结果路径
-            os.system(f'cp "{output_filepath}" "{result_filepath}"')
+        if replacements or color_pairs:
+            # 文字修改与颜色修改在内存中完成，编辑历史只记录发生变化的图块；
+            # 在同一版本上重复提交相同的修改时，直接使用编辑结果缓存中的差异
+            intermediate_path = None
+            if app.config['SAVE_INTERMEDIATE']:
+                intermediate_path = os.path.join(app.config['OUTPUT_FOLDER'], filename)
+            description = ', '.join([f"{a} -> {b}" for a, b in replacements] +
+                                    [f"{a} -> {b}" for a, b in color_pairs])
+            try:
+                history.commit_edit(
+                    description, replacements=replacements, color_pairs=color_pairs,
+                    region=region, preprocess=app.config['OCR_PREPROCESS'],
+                    intermediate_path=intermediate_path,
+                    pixel_threshold=app.config['TILED_PIXEL_THRESHOLD'])
+            except ValueError as e:
+                return str(e), 400
 
         # 重定向至结果页面
-        return redirect(url_for('result', filename=f"result_{filename}"))
+        return redirect(url_for('result', filename=filename))
+
+    # 提取当前版本中的文字及其位置信息（可只识别选区）
+    try:
+        text_boxes = extract_text_and_boxes(None, region=region, preprocess=app.config['OCR_PREPROCESS'],
+                                            image=history.materialize(), content_hash=history.content_hash())
+    except ValueError as e:
+        return str(e), 400
+
+    return render_template('combine_edit_options.html', filename=filename, text_boxes=text_boxes, region=region)
 
-    return render_template('combine_edit_options.html', filename=filename, text_boxes=text_boxes)
+
+@app.route('/batch', methods=['GET', 'POST'])
+def batch_edit():
+    """
+    批量修改：上传图片 ZIP 和编辑规则（JSON），返回结果 ZIP（内含 report.json 处理报告）
+    """
+    if request.method == 'POST':
+        file = request.files.get('file')
+        if not file or file.filename == '':
+            return "No file uploaded", 400
+
+        work_dir = tempfile.mkdtemp(prefix='batch_', dir=app.config['UPLOAD_FOLDER'])
+        source_path = os.path.join(work_dir, secure_filename(file.filename) or 'batch.zip')
+        file.save(source_path)
+
+        result_filename = f"result_{os.path.basename(work_dir)}.zip"
+        result_filepath = os.path.join(app.config['RESULT_FOLDER'], result_filename)
+        try:
+            run_batch(source_path, request.form.get('spec', ''), result_filepath, app.config['BATCH_WORKERS'])
+        except ValueError as e:
+            return str(e), 400
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+        return send_file(os.path.abspath(result_filepath), mimetype='application/zip', as_attachment=True,
+                         download_name=result_filename)
+
+    return render_template('combine_batch.html')
 
 
 @app.route('/result/<filename>')
 def result(filename):
     """
-    显示最终修改后的图片
+    显示最终修改后的图片（编辑历史的当前版本）
+    """
+    history = _history(filename)
+    return render_template('combine_result.html', filename=filename, history=history)
+
+
+@app.route('/undo/<filename>', methods=['POST'])
+def undo_edit(filename):
+    """
+    撤销上一步修改
     """
-    return render_template('combine_result.html', result_image=filename)
+    _history(filename).undo()
+    return redirect(url_for('result', filename=filename))
+
+
+@app.route('/redo/<filename>', methods=['POST'])
+def redo_edit(filename):
+    """
+    重做被撤销的修改
+    """
+    _history(filename).redo()
+    return redirect(url_for('result', filename=filename))
+
+
+@app.route('/current/<filename>')
+def serve_current(filename):
+    """
+    提供编辑历史当前版本的访问路径（按需合成，不写入磁盘）
+    """
+    image_format, ext = _image_format(filename)
+    data = _history(filename).encode(image_format)
+    return send_file(io.BytesIO(data), mimetype=mimetypes.guess_type(f"x{ext}")[0] or 'image/png')
 
 
 @app.route('/uploads/<filename>')
@@ -120,10 +239,19 @@ def serve_result(filename):
 @app.route('/download/<filename>')
 def download_image(filename):
     """
-    下载修改后的图片
+    下载修改后的图片：上传图片返回编辑历史的当前版本（编码结果在内存中按版本缓存），
+    其他文件从结果目录中读取
     """
-    result_filepath = os.path.join(app.config['RESULT_FOLDER'], filename)
-    return send_file(result_filepath, mimetype='image/png', as_attachment=True)
+    upload_path = os.path.join(app.config['UPLOAD_FOLDER'], secure_filename(filename))
+    if os.path.isfile(upload_path):
+        history = _history(filename)
+        mimetype = mimetypes.guess_type(filename)[0] or 'image/png'
+        data = history.encode(_image_format(filename)[0])
+        return send_file(io.BytesIO(data), mimetype=mimetype, as_attachment=True,
+                         download_name=f"result_{filename}")
+
+    return send_from_directory(os.path.abspath(app.config['RESULT_FOLDER']), filename, mimetype='image/png',
+                               as_attachment=True)
 
 
 if __name__ == '__main__':
@@ -6,6 +6,8 @@ from datetime import datetime
 import json
 import requests
 
+from page_range import PageRangeSet
+
 def allowed_file(filename):
     """检查文件是否允许上传"""
     ALLOWED_EXTENSIONS = {'pdf'}
@@ -13,42 +15,19 @@ def allowed_file(filename):
         filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 def parse_page_range(page_spec, total_pages):
-    """解析页码范围，返回页码索引列表（0-based）"""
+    """
+    解析页码范围，如 "5"、"3-5"、"1,3,5-8"。
+    :param page_spec: 页码范围字符串（1-based），为空时表示所有页
+    :param total_pages: 文档总页数，超出范围的页码会被截掉
+    :return: 页码索引（0-based）的 PageRangeSet，解析失败时为空集合
+    """
     if not page_spec:
-        return list(range(total_pages))
-
-    # 如果输入是字符串
-    if isinstance(page_spec, str):
-        # 处理连续范围 "3-5"
-        if '-' in page_spec:
-            try:
-                start, end = map(int, page_spec.split('-'))
-                return list(range(max(0, start - 1), min(total_pages, end)))
-            except:
-                return []
-
-        # 处理逗号分隔列表 "1,3,5"
-        elif ',' in page_spec:
-            try:
-                pages = []
-                for part in page_spec.split(','):
-                    if '-' in part:
-                        start, end = map(int, part.split('-'))
-                        pages.extend(range(max(0, start - 1), min(total_pages, end)))
-                    else:
-                        page_num = int(part) - 1
-                        if 0 <= page_num < total_pages:
-                            pages.append(page_num)
-                return list(set(pages))  # 去重
-            except:
-                return []
+        return PageRangeSet([(0, total_pages - 1)])
 
-        # 单个页码 "5"
-        else:
-            try:
-                page_num = int(page_spec) - 1
-                return [page_num] if 0 <= page_num < total_pages else []
-            except:
-                return []
+    if not isinstance(page_spec, str):
+        return PageRangeSet()
 
-    return []
\ No newline at end of file
+    try:
+        return PageRangeSet.parse(page_spec).clamp(1, total_pages).shift(-1)
+    except ValueError:
+        return PageRangeSet()